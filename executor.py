@@ -0,0 +1,575 @@
+# vim: set ai ts=4 sw=4 sts=4 noet fileencoding=utf-8 ft=python
+
+'''
+This module provides executors which run the jobs of the simulation chain.
+Every job is a self-contained task, a shell command together with its
+working directory and log file. The executors behave like a batch queue:
+tasks are submitted, their status is polled and they can be cancelled.
+Every executor can be awaited from an asyncio event loop with execute(),
+which supervises the task until it is finished and cancels it if the
+coroutine is cancelled.
+New backends can be added by implementing the Executor interface and
+registering them in EXECUTORS. The queue executor together with work()
+lets several hosts drain one production from a shared filesystem.
+The output of a task is passed line by line to its scanner while the
+task runs, the local executor rotates and compresses large log files.
+'''
+
+import os
+import re
+import gzip
+import json
+import shutil
+import time
+import signal
+import socket
+import asyncio
+import subprocess
+import concurrent.futures
+
+
+class Task:
+    '''
+    Self-contained unit of work: a shell command, the directory
+    it is executed in and the log file its output is written to
+    '''
+    def __init__(self, name, cmd, cwd, log, stderr=True):
+        self.name = name
+        self.cmd = cmd
+        self.cwd = cwd
+        self.log = log
+        self.stderr = stderr  # write stderr to the log file as well
+        self.id = None
+        self.status = 'new'  # new, queued, running or finished
+        self.ret = None
+        self.scanner = None  # gets every line of the output while the task runs
+
+
+class ErrorScanner:
+    '''
+    Look for error signatures, given as a dict of names and regular
+    expressions, in the output of a task. The first line matching a
+    signature is kept, the callback is called when it is found.
+    '''
+    def __init__(self, signatures, callback=None):
+        self.signatures = dict((name, re.compile(regex)) for name, regex in signatures.items())
+        self.callback = callback
+        self.errors = {}
+
+    def feed(self, line):
+        if isinstance(line, bytes):
+            line = line.decode(errors='replace')
+        for name, regex in self.signatures.items():
+            if name not in self.errors and regex.search(line):
+                self.errors[name] = line.strip()
+                if self.callback:
+                    self.callback(name, self.errors[name])
+
+
+class RotatingLog:
+    '''
+    Log file which is rotated when it exceeds max_size bytes, the old
+    parts are compressed to <log>.1.gz, <log>.2.gz, ... and only the
+    latest backups are kept. A max_size of 0 disables the rotation.
+    The parts are compressed in a background thread, the log is written
+    from the event loop which supervises all tasks.
+    '''
+    def __init__(self, path, max_size=0, backups=3):
+        self.path = path
+        self.max_size = max_size
+        self.backups = backups
+        self.parts = 0
+        self.compressor = None  # single thread, the parts are compressed in the order they have been written
+        self.file = open(path, 'ab')
+
+    def write(self, data):
+        self.file.write(data)
+        if self.max_size and self.file.tell() > self.max_size:
+            self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        if self.backups:
+            self.parts += 1
+            part = '%s.part%d' % (self.path, self.parts)
+            os.replace(self.path, part)
+            if self.compressor is None:
+                self.compressor = concurrent.futures.ThreadPoolExecutor(1)
+            self.compressor.submit(self.compress, part)
+        self.file = open(self.path, 'wb')
+
+    def compress(self, part):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.isfile('%s.%d.gz' % (self.path, i)):
+                os.replace('%s.%d.gz' % (self.path, i), '%s.%d.gz' % (self.path, i + 1))
+        with open(part, 'rb') as f_in, gzip.open(self.path + '.1.gz', 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(part)
+
+    def close(self):
+        self.file.close()
+        if self.compressor:
+            # parts which are still being compressed are finished in the background
+            self.compressor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class LogFollower:
+    '''
+    Read the lines which have been appended to a log file written by
+    another process since the last call, like tail -f
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.position = os.path.getsize(path) if os.path.isfile(path) else 0
+        self.rest = b''
+
+    def lines(self):
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() < self.position:  # the file has been truncated or rotated
+                    self.position = 0
+                f.seek(self.position)
+                data = f.read()
+                self.position = f.tell()
+        except FileNotFoundError:
+            return []
+        lines = (self.rest + data).split(b'\n')
+        self.rest = lines.pop()
+        return lines
+
+
+class Executor:
+    '''
+    Interface of all executors, a task is submitted to a queue and
+    runs as soon as one of the slots of the executor is free
+    '''
+    name = None
+    poll_interval = 1  # seconds between two status requests
+
+    def __init__(self, slots=1):
+        self.slots = slots
+        self.tasks = []
+        self.requeued = []  # names of tasks which had to be started again, e.g. because a worker died
+
+    def submit(self, task):
+        raise NotImplementedError
+
+    def poll(self, task):
+        ''' Update and return the status of the task '''
+        raise NotImplementedError
+
+    def cancel(self, task):
+        raise NotImplementedError
+
+    def in_flight(self):
+        return [task for task in self.tasks if task.status in ('queued', 'running')]
+
+    def free_slots(self):
+        return self.slots - len(self.in_flight())
+
+    async def execute(self, task):
+        ''' Wait until a task is finished, it is submitted if this hasn't been done yet;
+            the log files written by the task are passed to its scanner in the meantime '''
+        logs = [task.log] if task.stderr else [task.log, os.path.splitext(task.log)[0] + '.err']
+        followers = [LogFollower(log) for log in logs] if task.scanner else []
+        if task.status == 'new':
+            self.submit(task)
+        loop = asyncio.get_running_loop()
+        try:
+            # polling runs batch system commands or reads a shared filesystem, it must not block the event loop
+            while await loop.run_in_executor(None, self.poll, task) != 'finished':
+                self.scan(task, followers)
+                await asyncio.sleep(self.poll_interval)
+        except asyncio.CancelledError:
+            self.cancel(task)
+            raise
+        self.scan(task, followers)
+        return task.ret
+
+    def scan(self, task, followers):
+        for follower in followers:
+            for line in follower.lines():
+                task.scanner.feed(line)
+
+
+class LocalExecutor(Executor):
+    '''
+    Batch queue on the local machine, the tasks are child processes of the
+    event loop and at most slots of them run at the same time. Their output
+    is drained asynchronously into the log file of the task.
+    '''
+    name = 'local'
+    terminate_timeout = 10  # seconds until a task which doesn't react to SIGTERM is killed
+
+    def __init__(self, slots=1, log_size=0, log_backups=3):
+        Executor.__init__(self, slots)
+        self.log_size = log_size  # size in bytes at which the log files are rotated, 0 to disable
+        self.log_backups = log_backups
+        self.processes = {}
+        self.semaphore = None
+
+    def submit(self, task):
+        task.id = len(self.tasks)
+        task.status = 'queued'
+        self.tasks.append(task)
+        return task.id
+
+    def poll(self, task):
+        return task.status
+
+    def cancel(self, task):
+        if task.id in self.processes:
+            self.signal(self.processes[task.id], signal.SIGTERM)
+        task.status = 'finished'
+
+    def signal(self, process, sig):
+        # the shell and the programs started by it run in their own process group
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    async def drain(self, task, stream, log):
+        async for line in stream:
+            log.write(line)
+            if task.scanner:
+                task.scanner.feed(line)
+
+    async def terminate(self, process):
+        self.signal(process, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), self.terminate_timeout)
+        except asyncio.TimeoutError:
+            self.signal(process, signal.SIGKILL)
+            await process.wait()
+
+    async def execute(self, task):
+        if task.status == 'new':
+            self.submit(task)
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.slots)
+        async with self.semaphore:
+            if task.status == 'finished':  # cancelled while waiting for a slot
+                return task.ret
+            err = os.path.splitext(task.log)[0] + '.err' if not task.stderr else os.devnull
+            process = None
+            try:
+                with RotatingLog(task.log, self.log_size, self.log_backups) as log, \
+                        RotatingLog(err, self.log_size if not task.stderr else 0, self.log_backups) as err_log:
+                    # a new session keeps Ctrl+C in the terminal away from the tasks, the executor decides what happens to them
+                    process = await asyncio.create_subprocess_shell(task.cmd, cwd=task.cwd, stdout=asyncio.subprocess.PIPE,
+                                                                    stderr=asyncio.subprocess.STDOUT if task.stderr else asyncio.subprocess.PIPE,
+                                                                    start_new_session=True, limit=2**20)
+                    self.processes[task.id] = process
+                    task.status = 'running'
+                    try:
+                        streams = [self.drain(task, process.stdout, log)]
+                        if not task.stderr:
+                            streams.append(self.drain(task, process.stderr, err_log))
+                        await asyncio.gather(*streams)
+                        task.ret = await process.wait()
+                    except asyncio.CancelledError:
+                        await self.terminate(process)
+                        task.ret = process.returncode
+                        raise
+            except OSError:
+                # the log files could not be written or the shell could not be started, the slot must not stay occupied
+                if process and process.returncode is None:
+                    await self.terminate(process)
+                task.ret = 1
+            finally:
+                self.processes.pop(task.id, None)
+                task.status = 'finished'
+        return task.ret
+
+
+def query(cmd):
+    ''' Return the output of a status command, unknown jobs result in an empty string '''
+    p = subprocess.Popen(cmd, universal_newlines=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return p.communicate()[0].strip()
+
+
+class SlurmExecutor(Executor):
+    '''
+    Submit every task as a job script to a SLURM batch system
+    '''
+    name = 'slurm'
+    poll_interval = 30
+
+    def __init__(self, slots=100, script_dir='.', setup='', options=''):
+        Executor.__init__(self, slots)
+        self.script_dir = script_dir
+        self.setup = setup
+        self.options = options
+
+    def script(self, task):
+        lines = ['#!/bin/bash',
+                 '#SBATCH --job-name=%s' % task.name,
+                 '#SBATCH --output=%s' % task.log,
+                 '#SBATCH --open-mode=append']
+        if not task.stderr:
+            lines.append('#SBATCH --error=%s' % (os.path.splitext(task.log)[0] + '.err'))
+        lines.extend(['#SBATCH ' + option for option in self.options.split()])
+        if self.setup:
+            lines.append(self.setup)
+        lines.extend(['cd %s' % task.cwd, task.cmd, ''])
+        file = os.path.join(self.script_dir, task.name + '.sh')
+        with open(file, 'w') as f:
+            f.write('\n'.join(lines))
+        return file
+
+    def submit(self, task):
+        output = subprocess.check_output(['sbatch', '--parsable', self.script(task)], universal_newlines=True)
+        task.id = output.strip().split(';')[0]
+        task.status = 'queued'
+        self.tasks.append(task)
+        return task.id
+
+    def poll(self, task):
+        if task.status == 'finished':
+            return task.status
+        state = query(['squeue', '-h', '-j', task.id, '-o', '%T'])
+        if state in ('PENDING', 'CONFIGURING'):
+            task.status = 'queued'
+        elif state:
+            task.status = 'running'
+        else:
+            # the job left the queue, get the exit code from the accounting
+            output = query(['sacct', '-n', '-X', '-P', '-j', task.id, '-o', 'State,ExitCode'])
+            if not output:
+                return task.status
+            state, code = output.splitlines()[0].split('|')
+            exit_code, sig = [int(field) for field in code.split(':')]
+            if state == 'COMPLETED':
+                task.ret = exit_code
+            else:
+                # failed, cancelled, killed by a signal or for running out of memory or time;
+                # like for local processes a negative return code names the signal
+                task.ret = exit_code or (-sig if sig else 1)
+            task.status = 'finished'
+        return task.status
+
+    def cancel(self, task):
+        subprocess.call(['scancel', task.id])
+        task.status = 'finished'
+
+
+class WorkQueue:
+    '''
+    Queue of tasks in a directory on a shared filesystem. Every task is
+    stored as <name>.task, a worker claims it by creating <name>.lock
+    exclusively and holds the lease as long as it touches the lock file.
+    The return code of a finished task is written to <name>.done.
+    '''
+    def __init__(self, path, lease=600):
+        self.path = path
+        self.lease = lease  # seconds after which a lock which hasn't been touched is considered lost
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def file(self, name, ext):
+        return os.path.join(self.path, name + ext)
+
+    def write(self, file, data):
+        ''' Write atomically, other hosts never see a partially written file '''
+        tmp = '%s.%s.%d.tmp' % (file, socket.gethostname(), os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, file)
+
+    def remove(self, file):
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            pass
+
+    def put(self, task):
+        self.remove(self.file(task.name, '.done'))
+        self.remove(self.file(task.name, '.lock'))
+        self.write(self.file(task.name, '.task'), {'name': task.name, 'cmd': task.cmd, 'cwd': task.cwd,
+                                                   'log': task.log, 'stderr': task.stderr})
+
+    def pending(self):
+        ''' Names of the tasks which haven't been claimed yet, oldest first '''
+        files = [f for f in os.listdir(self.path) if f.endswith('.task')]
+        names = [f[:-5] for f in files if not os.path.exists(self.file(f[:-5], '.lock'))]
+        def age(name):
+            try:
+                return os.path.getmtime(self.file(name, '.task'))
+            except FileNotFoundError:
+                return 0
+        return sorted(names, key=age)
+
+    def claim(self, name, owner):
+        ''' Try to get the lease of a task, return the task or None if another worker was faster '''
+        try:
+            fd = os.open(self.file(name, '.lock'), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return None
+        with os.fdopen(fd, 'w') as f:
+            f.write(owner)
+        try:
+            with open(self.file(name, '.task'), 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            # the task has been finished or cancelled in the meantime
+            self.release(name, owner)
+            return None
+        return Task(data['name'], data['cmd'], data['cwd'], data['log'], data['stderr'])
+
+    def owner(self, name):
+        try:
+            with open(self.file(name, '.lock'), 'r') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def renew(self, name, owner):
+        ''' Extend the lease of a task, returns False if the lease has been lost or the task was cancelled '''
+        if self.owner(name) != owner or not os.path.exists(self.file(name, '.task')):
+            return False
+        os.utime(self.file(name, '.lock'))
+        return True
+
+    def release(self, name, owner):
+        if self.owner(name) == owner:
+            self.remove(self.file(name, '.lock'))
+
+    def finish(self, name, ret, owner):
+        if self.owner(name) != owner:
+            return
+        self.write(self.file(name, '.done'), {'ret': ret, 'worker': owner})
+        self.remove(self.file(name, '.task'))
+        self.remove(self.file(name, '.lock'))
+
+    def result(self, name):
+        ''' Return code of a finished task, the result is removed from the queue;
+            a finished task without a return code counts as failed '''
+        file = self.file(name, '.done')
+        try:
+            with open(file, 'r') as f:
+                ret = json.load(f).get('ret')
+        except (FileNotFoundError, ValueError):
+            return None
+        self.remove(file)
+        return 1 if ret is None else ret
+
+    def expired(self, name):
+        ''' Put a claimed task back into the queue if its lease has expired, e.g. because the worker died '''
+        try:
+            age = time.time() - os.path.getmtime(self.file(name, '.lock'))
+        except FileNotFoundError:
+            return False
+        if age < self.lease:
+            return False
+        self.remove(self.file(name, '.lock'))
+        return True
+
+    def cancel(self, name):
+        ''' Remove a task, a worker running it terminates the task when renewing its lease '''
+        self.remove(self.file(name, '.task'))
+        self.remove(self.file(name, '.done'))
+
+
+class QueueExecutor(Executor):
+    '''
+    Put the tasks into a work queue on a shared filesystem which is drained
+    by any number of workers (./run.py --worker) on one or more hosts
+    '''
+    name = 'queue'
+    poll_interval = 5
+
+    def __init__(self, slots=100, queue_dir='queue', lease=600):
+        Executor.__init__(self, slots)
+        self.queue = WorkQueue(queue_dir, lease)
+
+    def submit(self, task):
+        task.id = task.name
+        self.queue.put(task)
+        task.status = 'queued'
+        self.tasks.append(task)
+        return task.id
+
+    def poll(self, task):
+        if task.status == 'finished':
+            return task.status
+        ret = self.queue.result(task.id)
+        if ret is not None:
+            task.ret = ret
+            task.status = 'finished'
+        elif self.queue.owner(task.id) is None:
+            task.status = 'queued'
+        elif self.queue.expired(task.id):
+            self.requeued.append(task.id)
+            task.status = 'queued'
+        else:
+            task.status = 'running'
+        return task.status
+
+    def cancel(self, task):
+        self.queue.cancel(task.id)
+        task.status = 'finished'
+
+
+async def drain_queue(queue, owner, local, idle, poll_interval):
+    running = {}  # asyncio futures of the claimed tasks
+    last = time.time()
+    try:
+        while True:
+            for name in queue.pending():
+                if len(running) >= local.slots:
+                    break
+                task = queue.claim(name, owner)
+                if task:
+                    running[asyncio.ensure_future(local.execute(task))] = task
+            for future, task in list(running.items()):
+                if future.done():
+                    del running[future]
+                    # a task which could not be run at all counts as failed
+                    if future.cancelled() or future.exception() or task.ret is None:
+                        task.ret = 1
+                    queue.finish(task.name, task.ret, owner)
+                elif not queue.renew(task.name, owner):
+                    # the task has been cancelled or our lease expired and another worker took over
+                    future.cancel()
+                    del running[future]
+            if running:
+                last = time.time()
+            elif idle and time.time() - last > idle:
+                return
+            await asyncio.sleep(poll_interval)
+    finally:
+        for future, task in running.items():
+            future.cancel()
+            queue.release(task.name, owner)
+        await asyncio.gather(*running, return_exceptions=True)
+
+def work(queue_dir, slots=1, lease=600, idle=0, poll_interval=5, log_size=0, log_backups=3):
+    '''
+    Worker which claims tasks from a work queue and runs up to slots of them
+    in parallel on this host. It returns when no task could be claimed for
+    idle seconds, or never if idle is 0. Aborted tasks are terminated and
+    released, they will be processed by another worker.
+    '''
+    queue = WorkQueue(queue_dir, lease)
+    owner = '%s:%d' % (socket.gethostname(), os.getpid())
+    asyncio.run(drain_queue(queue, owner, LocalExecutor(slots, log_size, log_backups), idle, poll_interval))
+
+
+EXECUTORS = {
+    LocalExecutor.name: LocalExecutor,
+    SlurmExecutor.name: SlurmExecutor,
+    QueueExecutor.name: QueueExecutor
+}
+
+def get_executor(name, **options):
+    if name not in EXECUTORS:
+        raise ValueError("Unknown executor '%s', available: %s" % (name, ', '.join(sorted(EXECUTORS))))
+    return EXECUTORS[name](**options)
@@ -41,6 +41,48 @@ SMEAR_Z_VERTEX = True
 Z_VERTEX_SMEARING = 10  # unit in cm
 SMEAR_BEAM_POSITION = True
 BEAM_SMEARING = 2  # diameter for beam smearing, unit in cm
+# disk space management
+MIN_FREE_SPACE = 10  # free disk space in GB needed in DATA_OUTPUT_PATH, no new files will be started below this limit
+DISK_BUDGET = 0  # maximum disk space in GB the files produced during one run may occupy, 0 to disable
+STREAMING = False  # process every file through the whole chain before the next one is started, as many files at once as the executor has slots
+CLEANUP_INTERMEDIATES = ''  # 'delete' or 'compress' intermediate files as soon as all stages reading them are done, empty to keep them
+# master seed of a run, the random seeds of every file and stage are derived from it
+MASTER_SEED = 1
+# settings to split a target amount of events into files
+CORES = 0  # number of CPU cores which can be used for the simulation, 0 to use all cores of this machine
+MAX_EVENTS_PER_FILE = 100000
+MIN_EVENTS_PER_FILE = 10000
+# execution of the jobs
+EXECUTOR = 'local'  # 'local' to run the jobs in parallel on this machine (using CORES), 'slurm' for a batch system or 'queue'
+BATCH_SLOTS = 100  # maximum amount of jobs submitted to the batch system at the same time
+BATCH_SETUP = ''  # commands to set up the environment (ROOT, Geant4, ...) within batch jobs, e.g. 'source ~/setup.sh'
+BATCH_OPTIONS = ''  # additional options for the batch system, e.g. '--partition=long --mem=2G'
+QUEUE_PATH = ''  # work queue on a shared filesystem for the 'queue' executor, empty to use DATA_OUTPUT_PATH/queue
+QUEUE_LEASE = 600  # seconds after which a job is put back into the queue if its worker stopped responding
+QUEUE_IDLE = 0  # seconds after which a worker without jobs exits, 0 to keep waiting for new jobs
+# order in which the jobs of different channels are started
+SCHEDULING = 'order'  # 'order' as listed in the config, strict 'priority', 'round-robin' over channels or 'fair' share by priority
+SHORTEST_FIRST = False  # prefer the jobs with the shortest expected run time
+# ROOT compression of the output files for every stage as (algorithm, level), the algorithm can be 'zlib', 'lzma', 'lz4'
+# or 'zstd'; None keeps the default of the program. Pluto and hadd write their files directly with the setting, the output
+# of the other stages is compressed again after the job if it is kept, which costs an additional pass over the file
+COMPRESSION = {
+    'pluto': None,
+    'mkin': None,
+    'geant': None,
+    'acqu': None,
+    'goat': None,
+    'hadd': None  # e.g. ('lzma', 7) for the final merged files
+}
+# settings compared by the compression benchmark (--benchmark)
+BENCHMARK_COMPRESSION = [('zlib', 1), ('zlib', 4), ('lzma', 7), ('lz4', 4), ('zstd', 5)]
+# log files of the jobs
+LOG_SIZE = 50  # size in MB at which the log of a job is rotated and compressed, 0 to disable
+LOG_BACKUPS = 2  # amount of compressed parts of a log which are kept
+FATAL_ERRORS = ['segfault', 'missing file']  # error signatures (see ERROR_SIGNATURES) which let a job fail even if its output exists
+# live status of a running simulation
+STATUS_INTERVAL = 10  # seconds between two updates of the status table in DATA_OUTPUT_PATH/current_file
+STATUS_PORT = 0  # port of a local HTTP endpoint which reports the status as JSON, 0 to disable
 
 # End of user changes
 
@@ -48,6 +90,15 @@ import os, sys
 import re
 import errno
 import logging
+import gzip
+import json
+import argparse
+import itertools
+import configparser
+import shutil
+import hashlib
+import time
+import signal
 import datetime
 import subprocess
 import fileinput
@@ -55,6 +106,8 @@ from shutil import copyfile, move
 from os.path import join as pjoin
 # import module which provides colored output
 from color import *
+# the module executor, which runs the jobs locally or on a batch system, is only imported
+# when jobs are run to keep planning, listing and status requests fast (it needs asyncio)
 
 # paths for later usage
 pluto_data = ''
@@ -71,8 +124,122 @@ current_file = ''
 pluto_files = []
 mkin_files = []
 geant_files = []
-
-
+merged_files = []
+# the data directories are listed once while the simulation is planned, by directory and by stage and channel
+listings = {}
+stage_listings = {}
+
+# settings which can be changed for the variants of a sweep and the stage using them
+SWEEP_SETTINGS = {
+    'z_vertex_smearing': 'mkin',
+    'beam_smearing': 'mkin',
+    'target_length': 'geant',
+    'physics_list': 'geant',
+    'g4run': 'geant',
+    'acqu_config': 'acqu',
+    'goat_config': 'goat'
+}
+# relative path to DATA_OUTPUT_PATH where the files of sweep variants are stored
+VARIANT_DATA = 'variants'
+# variants of a sweep with their settings, ordered like in the sweep file
+variants = {}
+
+# channels and their weights which are generated together as a cocktail
+COCKTAIL = 'cocktail'
+cocktail = []
+# target amount of events per channel and stage which should be reached
+targets = []
+# priorities of the channels for the scheduling, 1 if not given
+priorities = {}
+SCHEDULERS = ['order', 'priority', 'round-robin', 'fair']
+
+# never wait for user input, e.g. for batch jobs
+unattended = False
+# only plan the simulation, neither directories nor the check cache are written
+read_only = False
+
+# stages of the simulation chain in the order they are processed
+STAGES = ['pluto', 'mkin', 'geant', 'acqu', 'goat', 'hadd']
+# stages whose output files are read by a stage
+STAGE_INPUTS = {
+    'pluto': [],
+    'mkin': ['pluto'],
+    'geant': ['mkin'],
+    'acqu': ['geant'],
+    'goat': ['acqu'],
+    'hadd': ['goat', 'pluto', 'geant']
+}
+STAGE_DESCRIPTION = {
+    'pluto': 'Pluto simulation',
+    'mkin': 'Converting file for Geant',
+    'geant': 'Geant simulation',
+    'acqu': 'AcquRoot particle reconstruction',
+    'goat': 'GoAT particle sorting',
+    'hadd': 'hadd file merging'
+}
+# output file names of the stages, completed with channel and file number
+STAGE_FILE = {
+    'pluto': 'sim_%s_%02d.root',
+    'mkin': 'sim_%s_%02d_mkin.root',
+    'geant': 'g4_sim_%s_%02d.root',
+    'acqu': 'Acqu_g4_sim_%s_%02d.root',
+    'goat': 'GoAT_g4_sim_%s_%02d.root',
+    'hadd': 'Goat_merged_%s_%02d.root'
+}
+# record of all processed jobs within DATA_OUTPUT_PATH
+CATALOG = 'catalog.json'
+# results of expensive checks together with the modification times of the files they depend on
+CHECK_CACHE = 'check_cache.json'
+# relative path to DATA_OUTPUT_PATH where the macros and configs of every job are rendered
+JOB_DATA = 'jobs'
+# rough estimate of the output size per event in kB for every stage,
+# only used to predict the disk usage until the first files are finished
+STAGE_EVENT_SIZE = {
+    'pluto': 1.5,
+    'mkin': 0.5,
+    'geant': 4.,
+    'acqu': 2.,
+    'goat': 1.,
+    'hadd': 6.5
+}
+# ROOT compression algorithms, the setting passed to ROOT is 100*algorithm + level
+COMPRESSION_ALGORITHMS = {
+    'zlib': 1,
+    'lzma': 2,
+    'lz4': 4,
+    'zstd': 5
+}
+# error messages which are looked for in the output of the jobs while they run;
+# Pluto usually crashes with a double free when ROOT exits after the file has been written
+ERROR_SIGNATURES = {
+    'segfault': r'segmentation violation|Segmentation fault|SIGSEGV',
+    'double free': r'double free or corruption',
+    'missing file': r'No such file or directory|[Ff]ile .* does not exist|[Cc]an(no|\')t open',
+    'out of memory': r'std::bad_alloc|[Oo]ut of memory'
+}
+# rough estimate of the run time per event in ms for every stage, used to schedule the jobs;
+# the whole chain needs around 12 hours per 1M events, mainly for the Geant simulation
+STAGE_EVENT_TIME = {
+    'pluto': 2.,
+    'mkin': .2,
+    'geant': 41.,
+    'acqu': .4,
+    'goat': .1,
+    'hadd': .1
+}
+# rough estimate of the peak memory in MB of a job of every stage, used by the dry run
+STAGE_MEMORY = {
+    'pluto': 300,
+    'mkin': 100,
+    'geant': 1000,
+    'acqu': 500,
+    'goat': 300,
+    'hadd': 200
+}
+
+
+# create the logger of asyncio before the colored logger class is set, otherwise it logs at debug level
+logging.getLogger('asyncio')
 logging.setLoggerClass(ColoredLogger)
 logger = logging.getLogger('Simulation')
 #logger.setLevel(logging.DEBUG)
@@ -225,34 +392,11 @@ def max_file_number(lst):
 def get_path(path, file):
     return os.path.expanduser(pjoin(path, file))
 
-def replace_all(file, search_exp, replace_exp, number_replacements=0):
-    if number_replacements < 0:
-        raise ValueError('Negative number of replacements submitted')
-
-    if number_replacements:
-        counter = 0
-    for line in fileinput.input(file, inplace=True):
-        if search_exp in line:
-            if number_replacements:
-                if counter == number_replacements:
-                    continue
-                else:
-                    counter += 1
-            line = replace_exp
-            #line = line.replace(search_exp, replace_exp)
-        print(line, end='')
-
-def replace_line(file, search_exp, replace_exp):
-    replace_all(file, search_exp, replace_exp, 1)
-
-def run(cmd, logfile, error=False):
-    if error:
-        p = subprocess.Popen(cmd, shell=True, universal_newlines=True, stdout=logfile, stderr=logfile)
+def confirm(message):
+    if unattended:
+        print(message)
     else:
-        p = subprocess.Popen(cmd, shell=True, universal_newlines=True, stdout=logfile)
-    #ret_code = p.wait()
-    #logfile.flush()
-    return p.wait()
+        input(message)
 
 def timestamp():
     return '[%s] ' % str(datetime.datetime.now()).split('.')[0]
@@ -269,74 +413,320 @@ def check_simulation_files(channel):
     pluto_channel = [f for f in pluto_files if channel in f]
     mkin_channel = [f for f in mkin_files if channel in f]
     geant_channel = [f for f in geant_files if channel in f]
+    merged_channel = [f for f in merged_files if channel in f]
     max_pluto = max_file_number(pluto_channel)
     max_mkin = max_file_number(mkin_channel)
     max_geant = max_file_number(geant_channel)
+    max_merged = max_file_number(merged_channel)
+    # intermediate files may have been cleaned up, only merged files are left in this case
+    if max_merged > max(max_pluto, max_mkin, max_geant):
+        return max_merged
     maximum = max_pluto
     if max_pluto > max_mkin:
         print_color("\tWarning", RED)
         print("Maybe there are some files for channel %s that\naren't converted yet (and hence simulated with Geant4)"
                 % format_channel(channel, False))
-        input("Will continue by pressing any key ")
+        confirm("Will continue by pressing any key ")
         maximum = max_pluto
     elif max_mkin > max_pluto:
         print_color("\tWarning", RED)
         print("There are more converted files than Pluto generated ones\nfor channel %s – proceed at your own risk"
                 % format_channel(channel, False))
-        input("Will continue by pressing any key ")
+        confirm("Will continue by pressing any key ")
         maximum = max_mkin
     if max_geant > maximum:
         print_color("\tWarning", RED)
         print("There are more Geant4 simulation files than Pluto generated\nfiles for channel %s"
                 % format_channel(channel, False))
-        input("Will continue by pressing any key ")
+        confirm("Will continue by pressing any key ")
         maximum = max_geant
     elif max_geant < maximum:
         print_color("\tWarning", RED)
         print("There are more Pluto generated files than Geant4 simulated\nfiles for channel %s"
                 % format_channel(channel, False))
-        input("Will continue by pressing any key ")
+        confirm("Will continue by pressing any key ")
 
     return maximum
 
+def file_events(filename):
+    ''' Amount of events in the first tree of a ROOT file, None if it can't be read '''
+    from ROOT import TFile
+    current = TFile(filename)
+    if not current.IsOpen():
+        print_error("The file '%s' could not be opened" % filename)
+        return None
+    trees = [key.GetName() for key in current.GetListOfKeys() if key.GetClassName() in ('TTree', 'TNtuple')]
+    if not trees:
+        print_error("Found no tree in file '%s'" % current.GetName())
+        return None
+    entries = current.Get(trees[0]).GetEntriesFast()
+    current.Close()
+    return entries
+
 def list_file_amount(events=False):
     print('Amount of simulated %s per channel:' % ('events' if events else 'files'))
+    catalog = load_catalog()
+    # intermediate files may have been cleaned up, hence the files of all stages and the catalog are considered;
+    # the mkin files are preferred to get the event numbers as every converted file has been complete
+    stages = ['mkin'] + [stage for stage in active_stages() if stage != 'mkin']
     for channel in channels:
-        pluto_channel = [f for f in pluto_files if channel in f]
-        mkin_channel = [f for f in mkin_files if channel in f]
-        geant_channel = [f for f in geant_files if channel in f]
-        max_pluto = max_file_number(pluto_channel)
-        max_mkin = max_file_number(mkin_channel)
-        max_geant = max_file_number(geant_channel)
-        maximum = max(max_pluto, max_mkin, max_geant)
+        outputs = [existing_files(stage, channel) for stage in stages]
+        numbers = set(n for files in outputs for n in files)
+        recorded = [entry['number'] for entry in catalog.values()
+                    if entry['channel'] == channel and entry['status'] == 'done' and not entry.get('variant')]
+        maximum = max(list(numbers) + recorded + [0])
         if maximum > 0:
             if not events:
                 print(' {0:<20s} -- {1:>3d} files'.format(format_channel(channel), maximum))
-            # assume every file contains the same amount of events, pick mkin files for event numbers
+            # the event numbers are taken from the catalog, ROOT is only needed for files which are not in there
             else:
                 sum = 0
-                from ROOT import TFile, TTree, TH1
-                for f in mkin_channel:
-                    filename = get_path(pluto_data, f)
-                    current = TFile(filename)
-                    if not current.IsOpen():
-                        print_error("The file '%s' could not be opened" % filename)
+                for number in numbers:
+                    files = [files[number] for files in outputs if number in files]
+                    cataloged = [cataloged_events(catalog, f[:-len('.gz')] if f.endswith('.gz') else f) for f in files]
+                    cataloged = [e for e in cataloged if e is not None]
+                    if cataloged:
+                        sum += cataloged[0]
                         continue
-                    elif not current.GetListOfKeys().GetSize():
-                        print_error("Found no directory in file '%s'" % current.GetName())
-                        continue
-                    name = current.GetListOfKeys().First().GetName()
-                    tree = current.Get(name)
-                    sum += tree.GetEntriesFast()
+                    plain = [f for f in files if not f.endswith('.gz')]
+                    entries = file_events(plain[0]) if plain else None
+                    if entries is not None:
+                        sum += entries
                 print(' {0:<20s} -- {1:>3d} files,  total {2:>8s} events'.format(format_channel(channel), maximum, unit_prefix(sum)))
 
+def set_paths():
+    ''' Set the paths derived from the user settings, nothing is checked or created '''
+    global pluto_data, geant_data, acqu_user, acqu_bin, acqu_data, goat_bin, goat_data, merged_data
+    pluto_data = get_path(DATA_OUTPUT_PATH, PLUTO_DATA)
+    geant_data = get_path(DATA_OUTPUT_PATH, GEANT_DATA)
+    if RECONSTRUCT:
+        acqu_user = get_path(ACQU_PATH, 'acqu_user')
+        acqu_bin = get_path(ACQU_BUILD, 'bin')
+        acqu_data = get_path(DATA_OUTPUT_PATH, ACQU_DATA)
+        goat_bin = get_path(GOAT_BUILD, 'bin')
+        goat_data = get_path(DATA_OUTPUT_PATH, GOAT_DATA)
+        merged_data = get_path(DATA_OUTPUT_PATH, MERGED_DATA)
+
+def list_dir(path):
+    if path not in listings:
+        listings[path] = os.listdir(path) if os.path.isdir(path) else []
+    return listings[path]
+
+def modification_time(file):
+    try:
+        return os.path.getmtime(file)
+    except OSError:
+        return None
+
+def memoize(name, compute):
+    ''' Return the result of an expensive check from the cache in DATA_OUTPUT_PATH as long
+        as none of the files it has been derived from was modified, compute returns the
+        result together with these files '''
+    cache_file = get_path(DATA_OUTPUT_PATH, CHECK_CACHE)
+    try:
+        with open(cache_file, 'r') as f:
+            cache = json.load(f)
+    except (IOError, ValueError):
+        cache = {}
+    entry = cache.get(name)
+    if entry and all(modification_time(file) == mtime for file, mtime in entry['files'].items()):
+        return entry['value']
+    value, files = compute()
+    if read_only:
+        return value
+    cache[name] = {'value': value, 'files': dict((file, modification_time(file)) for file in files)}
+    try:
+        with open(cache_file + '.tmp', 'w') as f:
+            json.dump(cache, f, indent=1)
+        os.replace(cache_file + '.tmp', cache_file)
+    except IOError:
+        pass  # the checks will be done again next time
+    return value
+
+def geant_target_length():
+    ''' Target length set in the DetectorSetup.mac macro of A2 Geant4, None if not found '''
+    mac = get_path(A2_GEANT_PATH, 'macros/DetectorSetup.mac')
+    def parse():
+        target_length = None
+        with open(mac, 'r') as f:
+            for line in f:
+                if '/A2/det/setTargetLength' in line:
+                    target_length = float(line.split()[1])
+        return target_length, [mac]
+    return memoize('target_length_%s' % mac, parse)
+
+def acqu_analysis():
+    ''' Name of the analysis setup file used by the AcquRoot config and whether it runs TA2GoAT '''
+    config = get_path(acqu_user, ACQU_CONFIG)
+    def parse():
+        analysis = None
+        with open(config, 'r') as file:
+            for line in file:
+                if 'AnalysisSetup:' in line:
+                    analysis = line.split()[-1]  # split spaces, tabs, newlines and take last entry of list
+        if analysis is None:
+            return (None, False), [config]
+        analysis_file = get_path(os.path.dirname(config), analysis)
+        goat = True
+        with open(analysis_file, 'r') as file:
+            for line in file:
+                if 'Physics-Analysis:' in line and not '#Physics-Analysis:' in line:
+                    if 'TA2GoAT' not in line:
+                        goat = False
+        return (analysis, goat), [config, analysis_file]
+    return memoize('acqu_analysis_%s' % config, parse)
+
+def find_executable(name):
+    ''' Path of an executable within PATH, the result is kept until one of the directories in PATH changes '''
+    def probe():
+        dirs = [d for d in os.environ.get('PATH', '').split(os.pathsep) if d]
+        return shutil.which(name), dirs
+    search_path = hashlib.sha256(os.environ.get('PATH', '').encode()).hexdigest()[:12]
+    return memoize('executable_%s_%s' % (name, search_path), probe)
+
+def job_graph(files):
+    ''' All jobs of the planned files, including the stages which are already
+        satisfied by existing files, mapped by their key '''
+    graph = dict((job.key(), job) for job in build_jobs(files))
+    for job in build_jobs([(channel, number, events, active_stages()) for channel, number, events, _ in files]):
+        if job.key() not in graph:
+            job.status = 'satisfied'
+            graph[job.key()] = job
+    return graph
+
+def critical_path(graph):
+    ''' Longest chain of planned jobs in seconds, assuming every job can start as soon as its inputs are ready '''
+    finish = {}
+    previous = {}
+    for job in sorted(graph.values(), key=lambda job: STAGES.index(job.stage)):
+        deps = dependencies(job, graph)
+        previous[job.key()] = max(deps, key=lambda dep: finish[dep.key()]) if deps else None
+        start = finish[previous[job.key()].key()] if deps else 0
+        finish[job.key()] = start + (estimated_time(job) if job.status == 'pending' else 0)
+    if not finish:
+        return 0, []
+    job = graph[max(finish, key=finish.get)]
+    duration = finish[job.key()]
+    path = []
+    while job:
+        if job.status == 'pending':
+            path.insert(0, job)
+        job = previous[job.key()]
+    return duration, path
+
+def dry_run(files, executor, export=None):
+    ''' Show the complete job graph of the planned files with a forecast of the
+        needed resources without running anything, optionally exported as JSON '''
+    graph = job_graph(files)
+    jobs = sorted(graph.values(), key=lambda job: (job.channel, job.number, STAGES.index(job.stage), job.variant or ''))
+    planned = [job for job in jobs if job.status == 'pending']
+    slots = (CORES or os.cpu_count() or 1) if executor == 'local' else BATCH_SLOTS
+    stages = {}
+    for stage in active_stages():
+        stage_jobs = [job for job in planned if job.stage == stage]
+        stages[stage] = {
+            'jobs': len(stage_jobs),
+            'satisfied': len([job for job in jobs if job.stage == stage and job.status == 'satisfied']),
+            'cpu_hours': sum(estimated_time(job) for job in stage_jobs)/3600,
+            'memory_mb': STAGE_MEMORY[stage],
+            'disk_gb': sum(estimated_size(job, {}) for job in stage_jobs)/1E9
+        }
+    cpu_hours = sum(stage['cpu_hours'] for stage in stages.values())
+    duration, path = critical_path(graph)
+    # the largest jobs which can run at the same time
+    peak_memory = sum(sorted((STAGE_MEMORY[job.stage] for job in planned), reverse=True)[:slots])/1E3
+    disk = sum(stage['disk_gb'] for stage in stages.values())
+    kept = sum(stage['disk_gb'] for name, stage in stages.items() if name in final_stages()) if CLEANUP_INTERMEDIATES else disk
+    report = {
+        'master_seed': MASTER_SEED,
+        'executor': executor,
+        'slots': slots,
+        'jobs': [dict(job.record(), name=job_name(job), output=job.output(),
+                      inputs=[job_name(dep) for dep in dependencies(job, graph)],
+                      cpu_hours=estimated_time(job)/3600 if job.status == 'pending' else 0,
+                      memory_mb=STAGE_MEMORY[job.stage] if job.status == 'pending' else 0,
+                      disk_gb=estimated_size(job, {})/1E9 if job.status == 'pending' else 0) for job in jobs],
+        'stages': stages,
+        'total': {
+            'jobs': len(planned),
+            'satisfied': len(jobs) - len(planned),
+            'cpu_hours': cpu_hours,
+            'wall_hours': max(duration/3600, cpu_hours/slots),
+            'peak_memory_gb': peak_memory,
+            'disk_gb': disk,
+            'kept_disk_gb': kept
+        },
+        'critical_path': {
+            'hours': duration/3600,
+            'jobs': [job_name(job) for job in path]
+        }
+    }
+    for job in report['jobs']:
+        job['status'] = 'planned' if job['status'] == 'pending' else job['status']
+        del job['start'], job['end'], job['return_code'], job['errors'], job['size']
+
+    print('\nDry run, %d jobs planned, %d already satisfied by existing files:' % (len(planned), len(jobs) - len(planned)))
+    print(' {0:<8s} {1:>8s} {2:>10s} {3:>10s} {4:>10s} {5:>10s}'.format('stage', 'jobs', 'satisfied', 'CPU hours', 'MB/job', 'disk [GB]'))
+    for name, stage in stages.items():
+        print(' {0:<8s} {jobs:>8d} {satisfied:>10d} {cpu_hours:>10.1f} {memory_mb:>10d} {disk_gb:>10.1f}'.format(name, **stage))
+    print(' Total %.1f CPU hours, at least %.1f hours with %d slots' % (cpu_hours, report['total']['wall_hours'], slots))
+    print(' Peak memory %.1f GB with %d jobs running at the same time' % (peak_memory, min(slots, len(planned))))
+    print(' %.1f GB written, %.1f GB kept' % (disk, kept))
+    print(' Critical path %.1f hours: %s' % (duration/3600, ' -> '.join(job_name(job) for job in path)))
+    if export:
+        with open(export, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(' Job graph and forecast written to %s' % export)
+
+def show_status():
+    ''' Summary of the jobs recorded in the catalog and the status of a running simulation '''
+    catalog = load_catalog()
+    if not catalog:
+        print('No jobs recorded in %s' % get_path(DATA_OUTPUT_PATH, CATALOG))
+    else:
+        stages = active_stages()
+        done = {}
+        failed = {}
+        events = {}
+        for record in catalog.values():
+            channel = record['channel']
+            if record['status'] == 'done':
+                done.setdefault(channel, {})
+                done[channel][record['stage']] = done[channel].get(record['stage'], 0) + 1
+                if record['stage'] == stages[-1]:
+                    events[channel] = events.get(channel, 0) + (record.get('events') or 0)
+            elif record['status'] in ('failed', 'aborted'):
+                failed[channel] = failed.get(channel, 0) + 1
+        print('Files per stage recorded in the catalog:')
+        print(' {0:<20s}'.format('channel') + ''.join('{0:>7s}'.format(stage) for stage in stages) + '{0:>9s}{1:>8s}'.format('events', 'failed'))
+        for channel in sorted(set(done) | set(failed)):
+            print(' {0:<20s}'.format(format_channel(channel)) + ''.join('{0:>7d}'.format(done.get(channel, {}).get(stage, 0)) for stage in stages)
+                  + '{0:>9s}{1:>8d}'.format(unit_prefix(events.get(channel, 0)), failed.get(channel, 0)))
+    status = get_path(DATA_OUTPUT_PATH, 'current_file')
+    if os.path.isfile(status):
+        print('\nRunning simulation:')
+        with open(status, 'r') as f:
+            print(f.read())
+
 # check if all the needed path and files exist
 def check_paths():
+    set_paths()
+    def output_dir(path):
+        # missing output directories are created unless the simulation is only planned
+        return read_only or check_path(path, True)
+
     # check if the given output path exists
     if not check_path(DATA_OUTPUT_PATH):
         print("        Please make sure the specified output directory exists.")
         return False
 
+    # check if ROOT is available to run Pluto and hadd
+    for executable in ['root'] + (['hadd'] if RECONSTRUCT or any(recompressed(stage) for stage in STAGES) else []):
+        if not find_executable(executable):
+            print_error("[ERROR] The executable '%s' could not be found" % executable)
+            print("        Please make sure ROOT is set up properly.")
+            return False
+
     # check if the A2 Geant4 executable exists in the given path
     # (created this way when the a2geant git repo is used)
     if not check_path(A2_GEANT_PATH):
@@ -351,12 +741,8 @@ def check_paths():
         if not check_file(geant_macros, 'DetectorSetup.mac'):
             print("        No 'DetectorSetup.mac' macro found in the Geant macros directory.")
             return False
-        target_length = ''
-        with open(get_path(geant_macros, 'DetectorSetup.mac'), 'r') as mac:
-            for line in mac:
-                if '/A2/det/setTargetLength' in line:
-                    target_length = line.split()[1]
-        if float(target_length) < Z_VERTEX_SMEARING:
+        target_length = geant_target_length()
+        if target_length is not None and target_length < Z_VERTEX_SMEARING:
             print_color("[WARNING] The target length specified in the 'DetectorSetup.mac' macro", RED)
             print_color('          in your Geant macros directory is smaller than your specified', RED)
             print_color('          z vertex smearing. Geant will correct the z vertex in order to', RED)
@@ -364,18 +750,11 @@ def check_paths():
             print_color('          if you want to use the vertex smearing of %.2f cm' % Z_VERTEX_SMEARING, RED)
             print()
 
-    # needed to modify global variables within this function
-    global pluto_data, geant_data, acqu_user, acqu_bin, acqu_data, goat_bin, goat_data, merged_data
-
     # create folders to store Pluto and Geant4 data if not existing
-    pluto_data = DATA_OUTPUT_PATH
-    geant_data = pluto_data[:]  # copy the string
-    pluto_data = get_path(pluto_data, PLUTO_DATA)
-    if not check_path(pluto_data, True):
+    if not output_dir(pluto_data):
         print("        Please make sure the Pluto output directory exists or could be created and is accessable as well.")
         return False
-    geant_data = get_path(geant_data, GEANT_DATA)
-    if not check_path(geant_data, True):
+    if not output_dir(geant_data):
         print("        Please make sure the Geant output directory exists or could be created and is accessable as well.")
         return False
     # check if the pluto2mkin converter is available
@@ -389,11 +768,9 @@ def check_paths():
         if not check_path(ACQU_PATH):
             print("        Please make sure your acqu directory can be found at the given path.")
             return False
-        acqu_user = get_path(ACQU_PATH, 'acqu_user')
         if not check_path(acqu_user):
             print("        Please make sure you installed acqu properly.")
             return False
-        acqu_bin = get_path(ACQU_BUILD, 'bin')
         if not check_file(acqu_bin, 'AcquRoot'):
             print("        Could not find the main AcquRoot executable.")
             print("        Please make sure you installed acqu properly.")
@@ -401,55 +778,44 @@ def check_paths():
         if not check_file(acqu_user, ACQU_CONFIG):
             print("        Could not find your specified AcquRoot config file.")
             return False
-        acqu_config_dir = pjoin(acqu_user, os.path.dirname(ACQU_CONFIG))
-        acqu_data = get_path(DATA_OUTPUT_PATH, ACQU_DATA)
-        if not check_path(acqu_data, True):
+        if not output_dir(acqu_data):
             print("        Please make sure the AcquRoot output directory exists or could be created and is accessable as well.")
             return False
         # check if AcquRoot is configured to execute TA2GoAT
-        with open(get_path(acqu_user, ACQU_CONFIG), 'r') as file:
-            for line in file:
-                if 'AnalysisSetup:' in line:
-                    acqu_analysis = line.split()[-1]  # split spaces, tabs, newlines and take last entry of list
-        with open(get_path(acqu_config_dir, acqu_analysis), 'r') as file:
-            for line in file:
-                if 'Physics-Analysis:' in line and not '#Physics-Analysis:' in line:
-                    if 'TA2GoAT' not in line:
-                        print_color("[ERROR] Specified analysis class in AcquRoot config '%s'" % acqu_analysis, RED)
-                        print_color("        is not TA2GoAT. Can't create files for GoAT this way.", RED)
-                        return False
+        acqu_analysis_setup, goat = acqu_analysis()
+        if not goat:
+            print_color("[ERROR] Specified analysis class in AcquRoot config '%s'" % acqu_analysis_setup, RED)
+            print_color("        is not TA2GoAT. Can't create files for GoAT this way.", RED)
+            return False
 
         # now check GoAT
         if not check_path(GOAT_PATH):
             print("        Please make sure your goat directory can be found at the given path.")
             return False
-        goat_bin = get_path(GOAT_BUILD, 'bin')
         if not check_file(goat_bin, 'goat'):
             print("        Could not find the main goat executable.")
             print("        Please make sure you installed GoAT properly.")
             return False
-        goat_bin = os.path.expanduser(goat_bin)
         if not check_file(GOAT_PATH, GOAT_CONFIG):
             print("        Could not find your specified goat config file.")
             return False
-        goat_data = get_path(DATA_OUTPUT_PATH, GOAT_DATA)
-        if not check_path(goat_data, True):
+        if not output_dir(goat_data):
             print("        Please make sure the GoAT output directory exists or could be created and is accessable as well.")
             return False
 
         # finally check directory for merged output
-        merged_data = get_path(DATA_OUTPUT_PATH, MERGED_DATA)
-        if not check_path(merged_data, True):
+        if not output_dir(merged_data):
             print("        Please make sure the output directory for merged files exists or could be created and is accessable as well.")
             return False
 
     return True
 
-def prepare_acqu():
-    config_org = pjoin(acqu_user, ACQU_CONFIG)
+def prepare_acqu(variant=None):
+    config_org = pjoin(acqu_user, variant_setting(variant, 'acqu_config', ACQU_CONFIG))
     acqu_configs = os.path.dirname(config_org)
-    config_new = pjoin(acqu_configs, 'AR.sim_chain')
-    if check_file(config_new, None):
+    config_new = pjoin(acqu_configs, 'AR.sim_chain' + ('_' + variant if variant else ''))
+    acqu_data = data_dir('acqu', variant)
+    if check_file(config_new, None) and not variant:
         for line in fileinput.input(config_new, inplace=True):
             if 'Directory:' in line:
                 line = 'Directory:\t%s\n' % acqu_data
@@ -467,179 +833,865 @@ def prepare_acqu():
         f.write('\nTreeFile:\tpath/file.root\n')
     return config_new
 
-def pluto_simulation(amount, sim_log):
-    total = sum(files*events for _, files, events, _ in amount)
-    print_color('\nStarting Pluto simulation for total %s events\n' % unit_prefix(total), RED)
-    sim_log.write('\n' + timestamp() + 'Starting Pluto simulation for total %s events\n' % unit_prefix(total))
-    with open(get_path(DATA_OUTPUT_PATH, 'pluto.log'), 'w') as log:
-        for index, (channel, files, events, number) in enumerate(amount, start=1):
-            print_color('Processing channel %s' % format_channel(channel, False), GREEN)
-            sim_log.write('\n' + timestamp() + 'Processing channel %s\n' % format_channel(channel, False))
-            for i in range(number+1, number+1+files):  # number is the highest existing file number, start with number+1, for end of range add number of files
-                logger.info('Generating file %s/sim_%s_%02d.root with %d events' % (pluto_data, channel, i, events))
-                sim_log.write(timestamp() + 'Generating file %s/sim_%s_%02d.root with %d events\n' % (pluto_data, channel, i, events))
-                sim_log.flush()
-                current = timestamp()
-                current += "Pluto simulation, channel %s (%d/%d), file %02d (%d/%d)" % (channel, index, len(amount), i, i-number, files)
-                write_current_info(current)
-                f = open('sim.C', 'w')
-                f.write('sim(){ gROOT->ProcessLine(".x simulate.C(%d, %d, \\\"%s\\\", \\\"%s\\\")"); }' % (events, i, channel, pluto_data))
-                f.close()
-                cmd = 'root -l sim.C'
-                # due to ROOT's double free curruption errors, pipe sys.stderr to pluto.log
-                ret = run(cmd, log, True)  # let Pluto print errors to the logfile as well because it prints normal information to stderr
-                if ret:
-                    logger.critical('Non-zero return code (%d), something might have gone wrong' % ret)
-                    sim_log.write(timestamp() + 'Non-zero return code (%d), something might have gone wrong\n' % ret)
-                    sim_log.flush()
-    print_color('\nFinished Pluto simulation\n', RED)
-    sim_log.write('\n' + timestamp() + 'Finished Pluto simulation\n\n')
-
-def mkin_conversion(amount, sim_log):
-    n_files = sum(files for _, files, _, _ in amount)
-    print_color('\nConversion of the %d Pluto-generated files\n' % n_files, RED)
-    sim_log.write('\n' + timestamp() + 'Conversion of the %d Pluto-generated files\n' % n_files)
+class Job:
+    '''
+    A single step of the simulation chain, i.e. one stage
+    applied to one file of a channel
+    '''
+    def __init__(self, stage, channel, number, events, variant=None):
+        self.stage = stage
+        self.channel = channel
+        self.number = number
+        self.events = events
+        self.variant = variant  # sweep variant whose settings are used, None for the default settings
+        self.status = 'pending'  # pending, running, done, failed, skipped or aborted
+        self.ret = None
+        self.seed = derive_seed(channel, number, stage)
+        self.start = None
+        self.end = None
+        self.task = None
+        self.index = 0
+        self.errors = {}  # error signatures found in the output and the first line matching them
+
+    def key(self):
+        return (self.stage, self.channel, self.number, self.variant)
+
+    def output(self):
+        return output_file(self.stage, self.channel, self.number, self.variant)
+
+    def input(self, stage):
+        return output_file(stage, self.channel, self.number, variant_owner(stage, self.variant))
+
+    def __str__(self):
+        if self.variant:
+            return '%s %s %02d [%s]' % (self.stage, self.channel, self.number, self.variant)
+        return '%s %s %02d' % (self.stage, self.channel, self.number)
+
+    def record(self):
+        return {
+            'stage': self.stage,
+            'channel': self.channel,
+            'number': self.number,
+            'variant': self.variant,
+            'events': self.events,
+            'status': self.status,
+            'return_code': self.ret,
+            'master_seed': MASTER_SEED,
+            'seed': self.seed,
+            'start': self.start,
+            'end': self.end,
+            'errors': self.errors,
+            'size': os.path.getsize(self.output()) if os.path.isfile(self.output()) else 0
+        }
+
+def derive_seed(channel, number, stage, shard=0):
+    ''' Derive a unique seed for the random generators used by a stage
+        from the master seed; different random generators within one
+        job can be distinguished by the shard number '''
+    key = '%d:%s:%d:%s:%d' % (MASTER_SEED, channel, number, stage, shard)
+    digest = hashlib.sha256(key.encode()).digest()
+    # seeds have to fit into a signed 32 bit integer and must not be zero
+    return int.from_bytes(digest[:4], 'big') % 2147483646 + 1
+
+def load_catalog():
+    file = get_path(DATA_OUTPUT_PATH, CATALOG)
+    if not os.path.isfile(file):
+        return {}
+    with open(file, 'r') as f:
+        return json.load(f)
+
+def save_catalog(catalog):
+    file = get_path(DATA_OUTPUT_PATH, CATALOG)
+    # write to a temporary file first to never leave a broken catalog behind
+    with open(file + '.tmp', 'w') as f:
+        json.dump(catalog, f, indent=1, sort_keys=True)
+    os.replace(file + '.tmp', file)
+
+def record_job(catalog, job):
+    ''' The catalog is written by the status reporter and at the end of the simulation '''
+    catalog[catalog_key(job.output())] = job.record()
+
+def active_stages():
+    if RECONSTRUCT:
+        return STAGES
+    return STAGES[:STAGES.index('geant')+1]
+
+# stages whose files are the result of the simulation and will never be cleaned up
+def final_stages():
+    if RECONSTRUCT:
+        return ['hadd']
+    return ['pluto', 'geant']
+
+def data_dir(stage, variant=None):
+    path = {
+        'pluto': pluto_data,
+        'mkin': pluto_data,
+        'geant': geant_data,
+        'acqu': acqu_data,
+        'goat': goat_data,
+        'hadd': merged_data
+    }[stage]
+    if not variant:
+        return path
+    return get_path(DATA_OUTPUT_PATH, pjoin(VARIANT_DATA, variant, os.path.basename(path)))
+
+def output_file(stage, channel, number, variant=None):
+    return pjoin(data_dir(stage, variant), STAGE_FILE[stage] % (channel, number))
+
+def upstream_stages(stage):
+    stages = set([stage])
+    for dep in STAGE_INPUTS[stage]:
+        stages |= upstream_stages(dep)
+    return stages
+
+def variant_setting(variant, setting, default):
+    if not variant:
+        return default
+    return variants[variant].get(setting, default)
+
+def variant_key(stage, variant):
+    ''' The settings of a variant which influence the output of a stage '''
+    if not variant:
+        return ()
+    stages = upstream_stages(stage)
+    return tuple(sorted((k, v) for k, v in variants[variant].items() if SWEEP_SETTINGS[k] in stages))
+
+def variant_owner(stage, variant):
+    ''' Return the first variant which produces the same files for the given stage,
+        these are shared by all variants; None if the default settings are used '''
+    key = variant_key(stage, variant)
+    if not key:
+        return None
+    for name in variants:
+        if variant_key(stage, name) == key:
+            return name
+
+def planned_files(amount):
+    ''' List the channel, number, events and stages to be processed of all files '''
+    return [(channel, i, events, active_stages()) for channel, n_files, events, number in amount
+            for i in range(number+1, number+1+n_files)]  # number is the highest existing file number
+
+def existing_files(stage, channel, variant=None):
+    ''' Map the file numbers of the existing output files of a stage for the given channel
+        to the file names, compressed intermediate files are included '''
+    path = data_dir(stage, variant)
+    if (stage, path) not in stage_listings:
+        pattern = re.escape(STAGE_FILE[stage]).replace('%s', '(.+)').replace('%02d', r'(\d+)')
+        regex = re.compile('^' + pattern + r'(\.gz)?$')
+        channel_files = {}
+        for file in list_dir(path):
+            match = regex.match(file)
+            if match:
+                channel_files.setdefault(match.group(1), {})[int(match.group(2))] = pjoin(path, file)
+        stage_listings[(stage, path)] = channel_files
+    return stage_listings[(stage, path)].get(channel, {})
+
+def catalog_key(file):
+    ''' Files are recorded relative to DATA_OUTPUT_PATH; the data directories are within it,
+        hence their prefix is simply cut off as computing the relative path is expensive '''
+    base = pjoin(os.path.expanduser(DATA_OUTPUT_PATH), '')
+    if file.startswith(base) and '/.' not in file:
+        return file[len(base):]
+    return os.path.relpath(file, os.path.expanduser(DATA_OUTPUT_PATH))
+
+def cataloged_events(catalog, file):
+    return catalog.get(catalog_key(file), {}).get('events')
+
+def choose_file_size(events):
+    ''' Split the events into files with at most MAX_EVENTS_PER_FILE events; the amount
+        of files is a multiple of the available cores as long as the files do not
+        get smaller than MIN_EVENTS_PER_FILE. Returns the amount of files and events per file '''
+    cores = CORES or os.cpu_count() or 1
+    n_files = max(1, -(-events // MAX_EVENTS_PER_FILE))
+    n_filled = -(-n_files // cores) * cores
+    if events // n_filled >= MIN_EVENTS_PER_FILE:
+        n_files = n_filled
+    else:
+        n_files = max(n_files, min(cores, events // MIN_EVENTS_PER_FILE))
+    return n_files, -(-events // n_files)
+
+def plan_target(channel, target, stage, catalog):
+    ''' Plan the files which are needed to reach the target amount of events
+        for a channel at the given stage. Missing or failed file numbers are
+        filled first, stages whose output still exists are not repeated. '''
+    stages = active_stages()[:active_stages().index(stage)+1]
+    outputs = dict((s, existing_files(s, channel)) for s in stages)
+    done = dict((n, f) for n, f in outputs[stage].items() if not f.endswith('.gz'))
+    cataloged = dict((f, cataloged_events(catalog, f)) for f in done.values())
+    known = [e for e in cataloged.values() if e is not None]
+    existing = sum(known)
+    unknown = [(n, f) for n, f in done.items() if cataloged[f] is None]
+    if unknown and known:
+        # files from before the catalog existed, assume they contain the typical amount of events
+        typical = existing // len(known)
+        print_color('[WARNING] Event numbers of %d files of channel %s unknown, assume %d events per file'
+                % (len(unknown), format_channel(channel, False), typical), RED)
+        existing += len(unknown)*typical
+    elif unknown:
+        # nothing to compare with, the files have to be counted
+        try:
+            counts = [file_events(f) for _, f in unknown]
+        except ImportError:
+            counts = [None]
+        if None in counts:
+            print_error('[ERROR] Event numbers of the files of channel %s unknown, the target can\'t be planned'
+                        % format_channel(channel, False))
+            print('     This channel will be skipped')
+            return [], None
+        existing += sum(counts)
+        if not read_only:
+            # keep the counts, the files don't have to be opened again the next time
+            for (number, file), events in zip(unknown, counts):
+                catalog[catalog_key(file)] = {'stage': stage, 'channel': channel, 'number': number, 'variant': None,
+                                              'events': events, 'status': 'done', 'size': os.path.getsize(file)}
+            save_catalog(catalog)
+    deficit = target - existing
+    if deficit <= 0:
+        return [], (channel, stage, target, existing, 0, 0, 0)
+    _, events = choose_file_size(deficit)
+    numbers = [max(files) for files in outputs.values() if files]
+    numbers += [entry['number'] for entry in catalog.values() if entry['channel'] == channel and not entry.get('variant')]
+    highest = max(numbers + [0])
+    files = []
+    # fill the holes left by missing or failed files first
+    for number in range(1, highest+1):
+        if deficit <= 0:
+            break
+        if number in done:
+            continue
+        first = 0
+        while first < len(stages) and not outputs[stages[first]].get(number, '.gz').endswith('.gz'):
+            first += 1
+        n_events = events
+        if first:
+            n_events = cataloged_events(catalog, outputs[stages[0]][number]) or events
+        files.append((channel, number, n_events, stages[first:]))
+        deficit -= n_events
+    holes = len(files)
+    n_files, events = choose_file_size(deficit) if deficit > 0 else (0, 0)
+    files.extend((channel, i, events, stages) for i in range(highest+1, highest+1+n_files))
+    return files, (channel, stage, target, existing, holes, n_files, events)
+
+def build_jobs(files):
+    ''' Create the jobs for all files which should be simulated. By default
+        every stage is done for all files before the next stage starts,
+        in streaming mode every file runs through the whole chain before
+        the next file is started. Stages whose output does not differ
+        between variants of a sweep are only processed once. '''
+    owners = {}
+    for stage in active_stages():
+        owners[stage] = []
+        for variant in list(variants) or [None]:
+            owner = variant_owner(stage, variant)
+            if owner not in owners[stage]:
+                owners[stage].append(owner)
+    if STREAMING:
+        return [Job(stage, channel, i, events, variant) for channel, i, events, stages in files
+                for stage in stages for variant in owners[stage]]
+    return [Job(stage, channel, i, events, variant) for stage in active_stages()
+            for channel, i, events, stages in files if stage in stages for variant in owners[stage]]
+
+def dependencies(job, graph):
+    deps = [(stage, job.channel, job.number, variant_owner(stage, job.variant)) for stage in STAGE_INPUTS[job.stage]]
+    # inputs which are not part of the graph have been produced before
+    return [graph[dep] for dep in deps if dep in graph]
+
+def consumers(job, graph):
+    return [j for j in graph.values() if job.channel == j.channel and job.number == j.number
+            and job in dependencies(j, graph)]
+
+def free_space(path=None):
+    if path is None:
+        path = DATA_OUTPUT_PATH
+    return shutil.disk_usage(os.path.expanduser(path)).free
+
+def check_free_space():
+    free = free_space()
+    if free < MIN_FREE_SPACE*1E9:
+        print_error("[ERROR] Only %.1f GB free disk space left in '%s'" % (free/1E9, DATA_OUTPUT_PATH))
+        print("        At least %.1f GB are needed, please free some disk space or change MIN_FREE_SPACE." % MIN_FREE_SPACE)
+        return False
+    return True
+
+def estimated_size(job, event_size):
+    ''' Predict the size of the output file of a job in bytes, based on the
+        size of already finished files or the rough default estimate '''
+    kb = event_size.get(job.stage, STAGE_EVENT_SIZE[job.stage])
+    return job.events*kb*1000
+
+def chain_state(jobs, produced, event_size):
+    ''' Estimated size of the complete chain of every file, the files which
+        have entered the chain and still have jobs to do, and the projected
+        disk usage: the files created during this run plus the expected size
+        of the files which are still missing for the files in flight '''
+    chains = {}
+    started = set()
+    for job in jobs:
+        file = (job.channel, job.number)
+        chains[file] = chains.get(file, 0) + estimated_size(job, event_size)
+        if job.status != 'pending':
+            started.add(file)
+    unfinished = [j for j in jobs if j.status in ('pending', 'running') and (j.channel, j.number) in started]
+    in_flight = set((j.channel, j.number) for j in unfinished)
+    usage = sum(produced.values()) + sum(estimated_size(j, event_size) for j in unfinished)
+    return chains, in_flight, usage
+
+def held_back(job, chains, in_flight, usage, free):
+    ''' Upstream jobs which start a new file are held back if the files
+        of the complete chain of this file would exceed the disk budget
+        or the minimal amount of free disk space '''
+    file = (job.channel, job.number)
+    if job.stage != active_stages()[0]:
+        return False
+    if DISK_BUDGET and usage + chains[file] > DISK_BUDGET*1E9:
+        return True
+    if free - chains[file] < MIN_FREE_SPACE*1E9:
+        return True
+    return False
+
+def estimated_time(job):
+    ''' Expected run time of a job in seconds '''
+    return job.events*STAGE_EVENT_TIME[job.stage]/1000
+
+def schedule(ready, jobs):
+    ''' Order the jobs which are ready to run according to SCHEDULING. Apart from
+        the plain config order, the next channel is chosen by its priority, the
+        amount of jobs it started (round-robin) or the expected run time of its
+        started jobs relative to its priority (fair share). Within a channel the
+        furthest stage comes first to finish files as early as possible. '''
+    started = {}
+    usage = {}
+    for job in jobs:
+        if job.status != 'pending':
+            started[job.channel] = started.get(job.channel, 0) + 1
+            usage[job.channel] = usage.get(job.channel, 0) + estimated_time(job)
+    def key(item):
+        index, job = item
+        priority = priorities.get(job.channel, 1)
+        if SCHEDULING == 'priority':
+            channel = -priority
+        elif SCHEDULING == 'round-robin':
+            channel = started.get(job.channel, 0)
+        elif SCHEDULING == 'fair':
+            channel = usage.get(job.channel, 0)/priority
+        else:
+            channel = 0
+        duration = estimated_time(job) if SHORTEST_FIRST else 0
+        downstream = -STAGES.index(job.stage) if SCHEDULING != 'order' else 0
+        return (channel, duration, downstream, index)
+    return [job for _, job in sorted(enumerate(ready), key=key)]
+
+def next_job(jobs, graph, produced, event_size, max_files=0):
+    ''' Next job to start; with STREAMING at most max_files files are in the chain at the same time,
+        a new file is only started once one of them is through the whole chain '''
+    ready = []
+    for job in jobs:
+        if job.status != 'pending':
+            continue
+        deps = dependencies(job, graph)
+        if any(dep.status in ('failed', 'skipped', 'aborted') for dep in deps):
+            job.status = 'skipped'
+            logger.warning('Skip %s, a needed input file is missing' % job)
+            continue
+        if any(dep.status != 'done' for dep in deps):
+            continue
+        ready.append(job)
+    if not ready:
+        return None
+    # the state of the chain is the same for all ready jobs
+    chains, in_flight, usage = chain_state(jobs, produced, event_size)
+    free = free_space()
+    for job in schedule(ready, jobs):
+        if STREAMING and (job.channel, job.number) not in in_flight and len(in_flight) >= max(max_files, 1):
+            continue
+        if not held_back(job, chains, in_flight, usage, free):
+            return job
+    return None
+
+def compress_file(file):
+    with open(file, 'rb') as f_in, gzip.open(file + '.gz', 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+
+async def remove_intermediate(file, produced):
+    import asyncio
+    if not os.path.isfile(file):
+        return
+    if CLEANUP_INTERMEDIATES == 'compress':
+        # compressing takes a while, the event loop keeps processing jobs in the meantime
+        await asyncio.get_running_loop().run_in_executor(None, compress_file, file)
+        produced[file + '.gz'] = os.path.getsize(file + '.gz')
+        logger.debug('Compressed intermediate file %s' % file)
+    else:
+        logger.debug('Removed intermediate file %s, freed %.1f MB' % (file, produced.get(file, 0)/1E6))
+    produced.pop(file, None)
+    os.remove(file)
+
+def cleanup_inputs(job, graph, produced):
+    ''' Delete or compress the inputs of a job which have been produced
+        during this run as soon as all their consumers are done,
+        returns the futures of the cleanups '''
+    import asyncio
+    cleanups = []
+    for dep in dependencies(job, graph):
+        if dep.stage in final_stages():
+            continue
+        if all(c.status == 'done' for c in consumers(dep, graph)):
+            cleanups.append(asyncio.ensure_future(remove_intermediate(dep.output(), produced)))
+    return cleanups
+
+def job_name(job):
+    name = '%s_%s_%02d' % (job.stage, job.channel, job.number)
+    if job.variant:
+        name += '_' + job.variant
+    return name
+
+def job_dir(job):
+    ''' Directory where the macros and configs of a job are rendered '''
+    return get_path(DATA_OUTPUT_PATH, pjoin(JOB_DATA, job_name(job)))
+
+def pluto_command(job, workdir):
+    macro = pjoin(workdir, 'sim.C')
+    seed_random = derive_seed(job.channel, job.number, job.stage, 1)
+    # Pluto and ROOT run in the same process, simulate.C writes the output with the compression setting
+    compression = compression_setting(*COMPRESSION['pluto']) if COMPRESSION.get('pluto') else -1
+    f = open(macro, 'w')
+    if job.channel == COCKTAIL:
+        names = ','.join(channel for channel, _ in cocktail)
+        weights = ','.join(str(weight) for _, weight in cocktail)
+        f.write('sim(){ gROOT->ProcessLine(".L simulate.C"); gROOT->ProcessLine("simulate_cocktail(%d, %d, \\\"%s\\\", \\\"%s\\\", \\\"%s\\\", %d, %d, %d)"); }'
+                % (job.events, job.number, names, weights, pluto_data, job.seed, seed_random, compression))
+    else:
+        f.write('sim(){ gROOT->ProcessLine(".x simulate.C(%d, %d, \\\"%s\\\", \\\"%s\\\", %d, %d, %d)"); }'
+                % (job.events, job.number, job.channel, pluto_data, job.seed, seed_random, compression))
+    f.close()
+    # simulate.C is loaded from the current directory
+    return 'root -l %s' % macro, os.getcwd()
+
+def mkin_command(job, workdir):
     cmd = get_path(A2_GEANT_PATH, 'pluto2mkin')
     ''' The vertex position can be smeared according to the target length (z vertex)
         and the beam diameter (x and y vertices)
         The z smearing is uniform, x and y are gaussian shaped. The values can be changed
-        in the top section of the file. '''
-    if SMEAR_Z_VERTEX:
-        cmd += ' --target length=%f' % Z_VERTEX_SMEARING
-    if SMEAR_BEAM_POSITION:
-        cmd += '  --beam diam=%f' % BEAM_SMEARING
-    with open(get_path(DATA_OUTPUT_PATH, 'mkin.log'), 'w') as log:
-        for index, (channel, files, events, number) in enumerate(amount, start=1):
-            for i in range(number+1, number+1+files):
-                current = timestamp()
-                current += "Converting files for Geant, channel %s (%d/%d), file %02d (%d/%d)" % (channel, index, len(amount), i, i-number, files)
-                write_current_info(current)
-                run(cmd + " --input %s/sim_%s_%02d.root" % (pluto_data, channel, i), log, True)  # mkin converter prints warning because of missing dictionary for PParticle to stderr
-                #run(cmd + " --input %s/%s_%02d.root --target length=10 --beam diam=2" % (pluto_data, channel, i), log)
-                # move the mkin file to the pluto simulation data directory
-                move('%s/sim_%s_%02d_mkin.root' % (os.getcwd(), channel, i), '%s/sim_%s_%02d_mkin.root' % (pluto_data, channel, i))
-    print_color('\nFinished converting the files\n', RED)
-    sim_log.write('\n' + timestamp() + 'Finished converting the files\n\n')
-
-def geant_simulation(amount, sim_log):
-    print_color('\n - - - Starting detector simulation - - - \n', RED)
-    sim_log.write('\n' + timestamp() + ' - - - Starting detector simulation - - - \n')
-    cmd = get_path(A2_GEANT_PATH, 'A2')
-    cmd += ' macros/vis.mac'
-    macro = get_path(A2_GEANT_PATH, 'macros/g4run_multi.mac')
-    wd = os.getcwd()
-    os.chdir(os.path.expanduser(A2_GEANT_PATH))
-    with open(get_path(DATA_OUTPUT_PATH, 'geant.log'), 'w') as log:
-        for index, (channel, files, events, number) in enumerate(amount, start=1):
-            print_color('Processing channel %s' % format_channel(channel, False), GREEN)
-            sim_log.write('\n' + timestamp() + 'Processing channel %s\n' % format_channel(channel, False))
-            macro_channel = get_path(wd, 'g4run/g4run_%s.mac' % channel)
-            for i in range(number+1, number+1+files):
-                logger.info('Performing simulation for file %s/sim_%s_%02d.root' % (pluto_data, channel, i))
-                sim_log.write(timestamp() + 'Performing simulation for file %s/sim_%s_%02d.root\n' % (pluto_data, channel, i))
-                sim_log.flush()
-                current = timestamp()
-                current += "Processing Geant simulation, channel %s (%d/%d), file %02d (%d/%d)" % (channel, index, len(amount), i, i-number, files)
-                write_current_info(current)
-                copyfile(macro_channel, macro)
-                f = open(macro, 'a')
-                f.write('/A2/generator/InputFile %s/sim_%s_%02d_mkin.root\n' % (pluto_data, channel, i))
-                f.write('/A2/event/setOutputFile %s/g4_sim_%s_%02d.root\n' % (geant_data, channel, i))
-                f.close()
-                ret = run(cmd, log, True)  # let Geant print errors to the logfile as well because it prints warnings to stderr
-                if ret:
-                    logger.critical('Non-zero return code (%d), something might have gone wrong' % ret)
-                    sim_log.write(timestamp() + 'Non-zero return code (%d), something might have gone wrong\n' % ret)
-                    sim_log.flush()
-    os.chdir(wd)
-    print_color('\nFinished the detector simulation\n', RED)
-    sim_log.write('\n' + timestamp() + 'Finished the detector simulation\n\n')
-
-def acqu(amount, sim_log):
-    print_color('\n - - - Starting particle reconstruction with AcquRoot - - - \n', RED)
-    sim_log.write('\n' + timestamp() + ' - - - Starting particle reconstruction with AcquRoot - - - \n')
-    config = prepare_acqu()
-    cmd = acqu_bin + '/AcquRoot' + ' ' + os.path.dirname(ACQU_CONFIG) + '/' + config.split('/')[-1]
-    wd = os.getcwd()
-    os.chdir(acqu_user)
-    with open(get_path(DATA_OUTPUT_PATH, 'acqu.log'), 'w') as log:
-        for index, (channel, files, events, number) in enumerate(amount, start=1):
-            print_color('Processing channel %s' % format_channel(channel, False), GREEN)
-            sim_log.write('\n' + timestamp() + 'Processing channel %s\n' % format_channel(channel, False))
-            for i in range(number+1, number+1+files):
-                logger.info('Reconstructing file %s/g4_sim_%s_%02d.root' % (geant_data, channel, i))
-                sim_log.write(timestamp() + 'Reconstructing file %s/g4_sim_%s_%02d.root\n' % (geant_data, channel, i))
-                sim_log.flush()
-                current = timestamp()
-                current += "AcquRoot particle reconstruction, channel %s (%d/%d), file %02d (%d/%d)" % (channel, index, len(amount), i, i-number, files)
-                write_current_info(current)
-                replace_line(config, 'TreeFile:', 'TreeFile:\t%s/g4_sim_%s_%02d.root' % (geant_data, channel, i))
-                ret = run(cmd, log)
-                if ret:
-                    logger.critical('Non-zero return code (%d), something might have gone wrong' % ret)
-                    sim_log.write(timestamp() + 'Non-zero return code (%d), something might have gone wrong\n' % ret)
-                    sim_log.flush()
-    os.chdir(wd)
-    print_color('\nFinished particle reconstruction\n', RED)
-    sim_log.write('\n' + timestamp() + 'Finished particle reconstruction\n\n')
-
-def goat(amount, sim_log):
-    print_color('\n - - - Starting GoAT particle sorting - - - \n', RED)
-    sim_log.write('\n' + timestamp() + ' - - - Starting GoAT particle sorting - - - \n')
-    cmd = goat_bin + '/goat' + ' ' + GOAT_CONFIG + ' -d ' + acqu_data + ' -D ' + goat_data
-    wd = os.getcwd()
-    os.chdir(os.path.expanduser(GOAT_PATH))
-    with open(get_path(DATA_OUTPUT_PATH, 'goat.log'), 'w') as log:
-        for index, (channel, files, events, number) in enumerate(amount, start=1):
-            print_color('Processing channel %s' % format_channel(channel, False), GREEN)
-            sim_log.write('\n' + timestamp() + 'Processing channel %s\n' % format_channel(channel, False))
-            for i in range(number+1, number+1+files):
-                input_file = 'Acqu_g4_sim_%s_%02d.root' % (channel, i)
-                logger.info('Processing file %s/%s' % (acqu_data, input_file))
-                sim_log.write(timestamp() + 'Processing file %s/%s\n' % (acqu_data, input_file))
-                sim_log.flush()
-                current = timestamp()
-                current += "GoAT particle sorting, channel %s (%d/%d), file %02d (%d/%d)" % (channel, index, len(amount), i, i-number, files)
-                write_current_info(current)
-                ret = run(cmd + ' -f ' + input_file, log)
-                if ret:
-                    logger.critical('Non-zero return code (%d), something might have gone wrong' % ret)
-                    sim_log.write(timestamp() + 'Non-zero return code (%d), something might have gone wrong\n' % ret)
-                    sim_log.flush()
-    os.chdir(wd)
-    print_color('\nFinished particle sorting\n', RED)
-    sim_log.write('\n' + timestamp() + 'Finished particle sorting\n\n')
-
-def hadd(amount, sim_log):
-    print_color('\n - - - Start merging root files - - - \n', RED)
-    sim_log.write('\n' + timestamp() + ' - - - Start merging root files - - - \n')
-    cmd = 'hadd '
-    wd = os.getcwd()
-    os.chdir(os.path.expanduser(DATA_OUTPUT_PATH))
-    with open('hadd.log', 'w') as log:
-        for index, (channel, files, events, number) in enumerate(amount, start=1):
-            print_color('Processing channel %s' % format_channel(channel, False), GREEN)
-            sim_log.write('\n' + timestamp() + 'Processing channel %s\n' % format_channel(channel, False))
-            for i in range(number+1, number+1+files):
-                output_file = '%s/Goat_merged_%s_%02d.root' % (merged_data, channel, i)
-                logger.info('Merging file %s' % output_file)
-                sim_log.write(timestamp() + 'Merging file %s\n' % output_file)
-                sim_log.flush()
-                current = timestamp()
-                current += "hadd file merging, channel %s (%d/%d), file %02d (%d/%d)" % (channel, index, len(amount), i, i-number, files)
-                write_current_info(current)
-                goat = '%s/GoAT_g4_sim_%s_%02d.root ' % (goat_data, channel, i)
-                pluto = '%s/sim_%s_%02d.root ' % (pluto_data, channel, i)
-                geant = '%s/g4_sim_%s_%02d.root' % (geant_data, channel, i)
-                current_cmd = cmd + output_file + ' ' + goat + pluto + geant
-                ret = run(current_cmd, log, True)  # print errors to the log file because of missing PParticle dictionary
-                if ret:
-                    logger.critical('Non-zero return code (%d), something might have gone wrong' % ret)
-                    sim_log.write(timestamp() + 'Non-zero return code (%d), something might have gone wrong\n' % ret)
-                    sim_log.flush()
-    os.chdir(wd)
-    print_color('\nFinished merging files\n', RED)
-    sim_log.write('\n' + timestamp() + 'Finished merging files\n\n')
+        in the top section of the file or per variant of a sweep. '''
+    z_smearing = variant_setting(job.variant, 'z_vertex_smearing', Z_VERTEX_SMEARING if SMEAR_Z_VERTEX else 0)
+    beam_smearing = variant_setting(job.variant, 'beam_smearing', BEAM_SMEARING if SMEAR_BEAM_POSITION else 0)
+    if z_smearing:
+        cmd += ' --target length=%f' % z_smearing
+    if beam_smearing:
+        cmd += '  --beam diam=%f' % beam_smearing
+    cmd += ' --input %s' % job.input('pluto')
+    # the converter writes to the working directory, move the mkin file to the pluto simulation data directory
+    mkin = 'sim_%s_%02d_mkin.root' % (job.channel, job.number)
+    return '%s; ret=$?; mv -f %s %s; exit $ret' % (cmd, mkin, job.output()), workdir
+
+def geant_workdir(variant):
+    if not variant:
+        return os.path.expanduser(A2_GEANT_PATH)
+    return get_path(DATA_OUTPUT_PATH, pjoin(VARIANT_DATA, variant, 'a2geant'))
+
+def patch_macro(file, command, value):
+    for line in fileinput.input(file, inplace=True):
+        if line.startswith(command):
+            line = '%s %s\n' % (command, value)
+        print(line, end='')
+
+def prepare_geant(variant):
+    ''' Create a working directory for Geant with the detector settings of a variant:
+        the macros directory is copied and modified, everything else is linked '''
+    workdir = geant_workdir(variant)
+    a2geant = os.path.expanduser(A2_GEANT_PATH)
+    if os.path.isdir(workdir):
+        shutil.rmtree(workdir)
+    os.makedirs(workdir)
+    for entry in os.listdir(a2geant):
+        if entry != 'macros':
+            os.symlink(pjoin(a2geant, entry), pjoin(workdir, entry))
+    macros = pjoin(workdir, 'macros')
+    shutil.copytree(pjoin(a2geant, 'macros'), macros)
+    settings = variants[variant]
+    if 'target_length' in settings:
+        patch_macro(pjoin(macros, 'DetectorSetup.mac'), '/A2/det/setTargetLength', settings['target_length'])
+    if 'physics_list' in settings:
+        patch_macro(pjoin(macros, 'vis.mac'), '/A2/physics/Physics', settings['physics_list'])
+
+def geant_command(job, workdir):
+    geant = geant_workdir(job.variant)
+    macro = pjoin(workdir, 'g4run.mac')
+    g4run = variant_setting(job.variant, 'g4run', 'g4run')
+    copyfile(get_path(os.getcwd(), '%s/g4run_%s.mac' % (g4run, job.channel)), macro)
+    f = open(macro, 'a')
+    f.write('/random/setSeeds %d %d\n' % (job.seed, derive_seed(job.channel, job.number, job.stage, 1)))
+    f.write('/A2/generator/InputFile %s\n' % job.input('mkin'))
+    f.write('/A2/event/setOutputFile %s\n' % job.output())
+    f.close()
+    # every job gets its own copy of vis.mac which executes the macro of this job
+    vis = pjoin(workdir, 'vis.mac')
+    with open(pjoin(geant, 'macros/vis.mac'), 'r') as f_in, open(vis, 'w') as f_out:
+        for line in f_in:
+            if line.startswith('/control/execute macros/g4run_multi.mac'):
+                line = '/control/execute %s\n' % macro
+            f_out.write(line)
+    return get_path(A2_GEANT_PATH, 'A2') + ' ' + vis, geant
+
+def acqu_command(job, workdir, config):
+    # AcquRoot expects the config relative to acqu_user, hence the job config is placed next to the prepared one
+    job_config = '%s_%s' % (config, job_name(job))
+    with open(config, 'r') as f_in, open(job_config, 'w') as f_out:
+        for line in f_in:
+            if 'TreeFile:' in line:
+                line = 'TreeFile:\t%s\n' % job.input('geant')
+            f_out.write(line)
+    cmd = acqu_bin + '/AcquRoot' + ' ' + os.path.dirname(variant_setting(job.variant, 'acqu_config', ACQU_CONFIG)) + '/' + os.path.basename(job_config)
+    return '%s; ret=$?; rm -f %s; exit $ret' % (cmd, job_config), acqu_user
+
+def goat_command(job, workdir):
+    input_file = job.input('acqu')
+    cmd = goat_bin + '/goat' + ' ' + variant_setting(job.variant, 'goat_config', GOAT_CONFIG)
+    cmd += ' -d ' + os.path.dirname(input_file) + ' -D ' + data_dir('goat', job.variant)
+    return cmd + ' -f ' + os.path.basename(input_file), os.path.expanduser(GOAT_PATH)
+
+def hadd_command(job, workdir):
+    goat = job.input('goat')
+    pluto = job.input('pluto')
+    geant = job.input('geant')
+    cmd = 'hadd'
+    if COMPRESSION.get('hadd'):
+        cmd += ' -f%d' % compression_setting(*COMPRESSION['hadd'])
+    return cmd + ' ' + ' '.join([job.output(), goat, pluto, geant]), os.path.expanduser(DATA_OUTPUT_PATH)
+
+def compression_setting(algorithm, level):
+    return 100*COMPRESSION_ALGORITHMS[algorithm] + level
+
+def check_compression():
+    for stage, setting in COMPRESSION.items():
+        if not setting:
+            continue
+        if len(setting) != 2 or setting[0] not in COMPRESSION_ALGORITHMS or setting[1] not in range(10):
+            print_error('[ERROR] Invalid compression %s for stage %s, use (algorithm, level) with algorithm %s and level 0-9'
+                        % (setting, stage, ', '.join(sorted(COMPRESSION_ALGORITHMS))))
+            return False
+        if stage not in ('pluto', 'hadd') and not recompressed(stage):
+            print_color('[WARNING] The %s files are removed after use, their compression setting is ignored' % stage, RED)
+    return True
+
+def compression_benchmark(stage):
+    ''' Write the first file of every channel with the compression settings
+        of BENCHMARK_COMPRESSION and report the speed and the file size '''
+    settings = ','.join(['0'] + [str(compression_setting(*setting)) for setting in BENCHMARK_COMPRESSION])
+    macro = pjoin(os.path.dirname(os.path.abspath(__file__)), 'compression_benchmark.C')
+    files = []
+    for channel in channels + [COCKTAIL]:
+        plain = [f for _, f in sorted(existing_files(stage, channel).items()) if not f.endswith('.gz')]
+        if plain:
+            files.append(plain[0])
+    if not files:
+        print_error('[ERROR] No %s files found for the benchmark' % stage)
+        return False
+    print_color('Compression benchmark on %d %s files, settings %s' % (len(files), stage, settings), GREEN)
+    for file in files:
+        subprocess.call(['root', '-l', '-b', '-q', '%s("%s", "%s")' % (macro, file, settings)])
+    return True
+
+def recompressed(stage):
+    ''' Pluto and hadd write their output directly with the compression setting, the output of the other stages
+        has to be rewritten; this is only worth the additional pass over the file if the file is kept '''
+    if stage in ('pluto', 'hadd') or not COMPRESSION.get(stage):
+        return False
+    return stage in final_stages() or not CLEANUP_INTERMEDIATES
+
+def recompress(cmd, job):
+    ''' Compress the output of a job again with the setting of its stage, hadd rewrites all baskets
+        of a single input file; the return code of the job itself is kept. The command of the job
+        runs in a subshell as it may exit on its own. '''
+    output = job.output()
+    tmp = output[:-len('.root')] + '_recompress.root'
+    return '(%s); ret=$?; if [ -f %s ]; then hadd -f%d %s %s && mv -f %s %s; fi; exit $ret' \
+        % (cmd, output, compression_setting(*COMPRESSION[job.stage]), tmp, output, tmp, output)
+
+def render_job(job, acqu_configs):
+    ''' Turn a job into a self-contained task which can be run by any executor,
+        all macros and configs needed by the job are written to its job directory '''
+    workdir = job_dir(job)
+    os.makedirs(workdir, exist_ok=True)
+    if job.stage == 'pluto':
+        cmd, cwd = pluto_command(job, workdir)
+    elif job.stage == 'mkin':
+        cmd, cwd = mkin_command(job, workdir)
+    elif job.stage == 'geant':
+        cmd, cwd = geant_command(job, workdir)
+    elif job.stage == 'acqu':
+        cmd, cwd = acqu_command(job, workdir, acqu_configs[job.variant])
+    elif job.stage == 'goat':
+        cmd, cwd = goat_command(job, workdir)
+    elif job.stage == 'hadd':
+        cmd, cwd = hadd_command(job, workdir)
+    if recompressed(job.stage):
+        cmd = recompress(cmd, job)
+    # Pluto prints normal information and ROOT its double free corruption errors to stderr, Geant its warnings
+    # and the mkin converter as well as hadd warnings about the missing PParticle dictionary,
+    # hence stderr is written to the logfile for these stages
+    stderr = job.stage not in ('acqu', 'goat')
+    from executor import Task
+    return Task(job_name(job), cmd, os.path.expanduser(cwd), pjoin(workdir, 'job.log'), stderr)
+
+def queue_path():
+    return os.path.expanduser(QUEUE_PATH) if QUEUE_PATH else get_path(DATA_OUTPUT_PATH, 'queue')
+
+def create_executor(name):
+    from executor import get_executor, EXECUTORS
+    if name not in EXECUTORS:
+        print_error("[ERROR] Unknown executor '%s', available executors: %s" % (name, ', '.join(sorted(EXECUTORS))))
+        return None
+    if name == 'local':
+        return get_executor(name, slots=CORES or os.cpu_count() or 1, log_size=LOG_SIZE*1E6, log_backups=LOG_BACKUPS)
+    if name == 'queue':
+        return get_executor(name, slots=BATCH_SLOTS, queue_dir=queue_path(), lease=QUEUE_LEASE)
+    script_dir = get_path(DATA_OUTPUT_PATH, JOB_DATA)
+    check_path(script_dir, True)
+    return get_executor(name, slots=BATCH_SLOTS, script_dir=script_dir, setup=BATCH_SETUP, options=BATCH_OPTIONS)
+
+def scan_errors(job, sim_log):
+    ''' Report error signatures as soon as they show up in the output of a running job '''
+    def found(name, line):
+        job.errors[name] = line
+        logger.warning('%s in %s: %s' % (name.capitalize(), job, line))
+        sim_log.write(timestamp() + '%s in %s: %s\n' % (name.capitalize(), job, line))
+    from executor import ErrorScanner
+    return ErrorScanner(ERROR_SIGNATURES, found)
+
+def kill_signal(job):
+    ''' Signal which terminated a job, None if it exited on its own; a negative return code is
+        reported if the shell was killed, 128 + signal if a program started by it was killed.
+        Pluto usually aborts when ROOT exits after the file has been written, which is ignored. '''
+    if job.ret is None or job.ret < 0:
+        sig = -job.ret if job.ret else None
+    else:
+        sig = job.ret - 128 if 128 < job.ret < 128 + 65 else None
+    if sig == signal.SIGABRT and job.stage == 'pluto':
+        return None
+    return sig
+
+def signal_name(sig):
+    try:
+        return signal.Signals(sig).name
+    except ValueError:
+        return 'signal %d' % sig
+
+def finish_job(job, catalog, produced, event_size, sim_log):
+    job.ret = job.task.ret
+    job.end = timestamp().strip(' []')
+    if job.ret:
+        logger.critical('Non-zero return code (%d) for %s, something might have gone wrong' % (job.ret, job))
+        sim_log.write(timestamp() + 'Non-zero return code (%d) for %s, something might have gone wrong\n' % (job.ret, job))
+    output = job.output()
+    if not os.path.isfile(output):
+        job.status = 'failed'
+        logger.error('Output file %s has not been created' % output)
+        sim_log.write(timestamp() + 'Output file %s has not been created\n' % output)
+        record_job(catalog, job)
+        return
+    fatal = [name for name in FATAL_ERRORS if name in job.errors]
+    sig = kill_signal(job)
+    if sig:
+        # the output of a killed job is most likely truncated
+        fatal.append('killed by %s' % signal_name(sig))
+    if fatal:
+        # keep the output for inspection, but don't let it be used by the following stages
+        job.status = 'failed'
+        move(output, output + '.failed')
+        logger.error('%s failed (%s), output moved to %s.failed' % (job, ', '.join(fatal), output))
+        sim_log.write(timestamp() + '%s failed (%s), output moved to %s.failed\n' % (job, ', '.join(fatal), output))
+        record_job(catalog, job)
+        return
+    job.status = 'done'
+    record_job(catalog, job)
+    produced[output] = os.path.getsize(output)
+    if job.events:
+        event_size[job.stage] = max(event_size.get(job.stage, 0), produced[output]/job.events/1000)
+
+def abort_job(job, catalog, sim_log):
+    ''' A terminated job may have left an incomplete output file behind which must not be used '''
+    job.status = 'aborted'
+    job.end = timestamp().strip(' []')
+    if os.path.isfile(job.output()):
+        os.remove(job.output())
+    logger.warning('Terminated %s' % job)
+    sim_log.write(timestamp() + 'Terminated %s\n' % job)
+    record_job(catalog, job)
+
+def chain_status(jobs, start):
+    ''' Amount of waiting, running, done and failed jobs as well as the throughput in events per hour for every stage '''
+    hours = max(time.time() - start, 1)/3600
+    stages = {}
+    for stage in STAGES:
+        stage_jobs = [job for job in jobs if job.stage == stage]
+        if not stage_jobs:
+            continue
+        events = sum(job.events for job in stage_jobs if job.status == 'done')
+        stages[stage] = {
+            'waiting': len([job for job in stage_jobs if job.status == 'pending']),
+            'running': len([job for job in stage_jobs if job.status == 'running']),
+            'done': len([job for job in stage_jobs if job.status == 'done']),
+            'failed': len([job for job in stage_jobs if job.status in ('failed', 'skipped', 'aborted')]),
+            'errors': len([job for job in stage_jobs if job.errors]),
+            'events': events,
+            'events_per_hour': round(events/hours)
+        }
+    return {
+        'time': timestamp().strip(' []'),
+        'elapsed': round(time.time() - start),
+        'stages': stages,
+        'running': [job_name(job) for job in jobs if job.status == 'running']
+    }
+
+def status_table(status):
+    lines = ['%s%d s elapsed' % (timestamp(), status['elapsed']),
+             '{0:<8s} {1:>8s} {2:>8s} {3:>8s} {4:>8s} {5:>8s} {6:>10s}'.format('stage', 'waiting', 'running', 'done', 'failed', 'errors', 'events/h')]
+    for stage, counts in status['stages'].items():
+        lines.append('{0:<8s} {waiting:>8d} {running:>8d} {done:>8d} {failed:>8d} {errors:>8d} {events_per_hour:>10d}'.format(stage, **counts))
+    lines.append('')
+    lines.extend('running: ' + name for name in status['running'])
+    return '\n'.join(lines) + '\n'
+
+async def report_status(jobs, start, catalog, sim_log):
+    ''' Keep the status table in current_file up to date and write the jobs
+        which have been finished in the meantime to the catalog '''
+    import asyncio
+    recorded = 0
+    while True:
+        write_current_info(status_table(chain_status(jobs, start)))
+        finished = len([job for job in jobs if job.end])
+        if finished != recorded:
+            save_catalog(catalog)
+            recorded = finished
+        sim_log.flush()
+        await asyncio.sleep(STATUS_INTERVAL)
+
+async def serve_status(jobs, start):
+    ''' Local HTTP endpoint which answers every request with the status as JSON '''
+    import asyncio
+    async def respond(reader, writer):
+        await reader.readline()
+        body = json.dumps(chain_status(jobs, start), indent=2).encode()
+        writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n' % len(body))
+        writer.write(body)
+        await writer.drain()
+        writer.close()
+    return await asyncio.start_server(respond, '127.0.0.1', STATUS_PORT)
+
+async def orchestrate(jobs, graph, executor, acqu_configs, catalog, produced, event_size, sim_log):
+    ''' Start jobs whenever the executor has a free slot and process them as soon as they are finished;
+        the first Ctrl+C stops starting new jobs and waits for the running ones, the second terminates them '''
+    import asyncio
+    loop = asyncio.get_running_loop()
+    running = {}  # asyncio futures of the running jobs
+    cleanups = []  # futures of intermediate files which are being removed or compressed
+    interrupts = []
+    def interrupt():
+        interrupts.append(timestamp())
+        if len(interrupts) == 1:
+            print_error('\nNo new jobs will be started, waiting for %d running jobs. Press Ctrl+C again to terminate them' % len(running))
+            sim_log.write(timestamp() + 'Interrupted, waiting for running jobs\n')
+        else:
+            print_error('\nTerminating %d running jobs' % len(running))
+            sim_log.write(timestamp() + 'Interrupted again, terminating running jobs\n')
+            for future in running:
+                future.cancel()
+    loop.add_signal_handler(signal.SIGINT, interrupt)
+    start = time.time()
+    reporter = asyncio.ensure_future(report_status(jobs, start, catalog, sim_log))
+    server = await serve_status(jobs, start) if STATUS_PORT else None
+    index = 0
+    try:
+        while True:
+            # fill the free slots of the executor with jobs whose inputs are ready
+            while not interrupts and executor.free_slots() > 0:
+                job = next_job(jobs, graph, produced, event_size, executor.slots)
+                if job is None:
+                    break
+                index += 1
+                logger.info('%s for file %s (job %d/%d)' % (STAGE_DESCRIPTION[job.stage], job.output(), index, len(jobs)))
+                sim_log.write(timestamp() + '%s for file %s\n' % (STAGE_DESCRIPTION[job.stage], job.output()))
+                job.task = render_job(job, acqu_configs)
+                job.task.scanner = scan_errors(job, sim_log)
+                job.status = 'running'
+                job.start = timestamp().strip(' []')
+                executor.submit(job.task)
+                running[asyncio.ensure_future(executor.execute(job.task))] = job
+            if not running and not cleanups:
+                break
+            # cleanups free disk space which held back jobs may be waiting for
+            finished, _ = await asyncio.wait(list(running) + cleanups, return_when=asyncio.FIRST_COMPLETED)
+            for name in executor.requeued:
+                logger.warning('Job %s lost its worker, it has been put back into the queue' % name)
+                sim_log.write(timestamp() + 'Job %s lost its worker, it has been put back into the queue\n' % name)
+            del executor.requeued[:]
+            for future in finished:
+                if future in cleanups:
+                    cleanups.remove(future)
+                    future.result()
+                    continue
+                job = running.pop(future)
+                if future.cancelled():
+                    abort_job(job, catalog, sim_log)
+                else:
+                    finish_job(job, catalog, produced, event_size, sim_log)
+                    if CLEANUP_INTERMEDIATES and job.status == 'done':
+                        cleanups.extend(cleanup_inputs(job, graph, produced))
+    finally:
+        # don't leave jobs behind if the simulation is aborted
+        for future in running:
+            future.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        for job in running.values():
+            abort_job(job, catalog, sim_log)
+        await asyncio.gather(*cleanups, return_exceptions=True)
+        save_catalog(catalog)
+        loop.remove_signal_handler(signal.SIGINT)
+        reporter.cancel()
+        if server:
+            server.close()
+    return bool(interrupts)
+
+def simulation_chain(files, sim_log, executor):
+    jobs = build_jobs(files)
+    graph = dict((job.key(), job) for job in jobs)
+    produced = {}  # files created during this run and their size
+    event_size = {}  # measured output size in kB per event for every stage
+    for path in set(os.path.dirname(job.output()) for job in jobs):
+        check_path(path, True)
+    for variant in set(job.variant for job in jobs if job.stage == 'geant' and job.variant):
+        prepare_geant(variant)
+    acqu_configs = {}
+    for variant in set(job.variant for job in jobs if job.stage == 'acqu'):
+        acqu_configs[variant] = prepare_acqu(variant)
+    catalog = load_catalog()
+    total = sum(events for _, _, events, _ in files)
+    print_color('\nStarting simulation chain for total %s events in %d jobs\n' % (unit_prefix(total), len(jobs)), RED)
+    sim_log.write('\n' + timestamp() + 'Starting simulation chain for total %s events in %d jobs\n' % (unit_prefix(total), len(jobs)))
+    sim_log.write(timestamp() + 'Executor: %s with %d slots\n' % (executor.name, executor.slots))
+    sim_log.write(timestamp() + 'Master seed: %d\n' % MASTER_SEED)
+    if DISK_BUDGET:
+        sim_log.write(timestamp() + 'Disk budget: %.1f GB\n' % DISK_BUDGET)
+    sim_log.write(timestamp() + 'Scheduling: %s%s\n' % (SCHEDULING, ', shortest jobs first' if SHORTEST_FIRST else ''))
+    if priorities:
+        sim_log.write(timestamp() + 'Priorities: %s\n' % ', '.join('%s=%g' % item for item in sorted(priorities.items())))
+    import asyncio
+    interrupted = asyncio.run(orchestrate(jobs, graph, executor, acqu_configs, catalog, produced, event_size, sim_log))
+
+    pending = [job for job in jobs if job.status == 'pending']
+    if pending and interrupted:
+        print_error('[ERROR] Simulation interrupted, %d jobs have not been started' % len(pending))
+        sim_log.write(timestamp() + 'Simulation interrupted, %d jobs have not been started\n' % len(pending))
+    elif pending:
+        print_error('[ERROR] Disk budget or free disk space exhausted, %d jobs could not be started' % len(pending))
+        sim_log.write(timestamp() + 'Disk budget or free disk space exhausted, %d jobs could not be started\n' % len(pending))
+    failed = [job for job in jobs if job.status in ('failed', 'skipped', 'aborted')]
+    if failed:
+        print_error('[ERROR] %d jobs failed, have been skipped or terminated' % len(failed))
+        sim_log.write(timestamp() + '%d jobs failed, have been skipped or terminated\n' % len(failed))
+    print_color('\nFinished simulation chain, %.1f GB stored on disk\n' % (sum(produced.values())/1E9), RED)
+    sim_log.write('\n' + timestamp() + 'Finished simulation chain, %.1f GB stored on disk\n\n' % (sum(produced.values())/1E9))
 
 def simulation_dialogue():
     amount = []
@@ -693,17 +1745,33 @@ def simulation_dialogue():
 
 def process_config(config_file):
     amount = []
+    cocktail_amount = None
     print_color('Configuration file found, will read channels to be simulated from it\n', GREEN)
     lines = [line for line in config_file.readlines() if not line.startswith('#') and line.split()]  # last part excludes empty lines
     for line in lines:
         channel = line.split()
         try:
-            if len(channel) != 3:
+            if len(channel) != 3 and not (len(channel) == 4 and channel[1] == 'total'):
                 print_error('[ERROR] Wrong number of arguments for channel %s' % channel[0])
                 print('     This channel will be skipped')
+            elif channel[1] == 'priority' and (channel[0] in channels or channel[0] == COCKTAIL):
+                if float(channel[2]) > 0:
+                    priorities[channel[0]] = float(channel[2])
+            elif channel[0] == COCKTAIL:
+                cocktail_amount = (int(channel[1]), int(channel[2]))
             elif channel[0] not in channels:
                 print_color('[WARNING] Channel "%s" unknown, will not be considered' % channel[0], RED)
-            elif channel[1] is not '0' and channel[2] is not '0':
+            elif channel[1] == 'weight':
+                if float(channel[2]) > 0:
+                    cocktail.append((channel[0], float(channel[2])))
+            elif channel[1] == 'total':
+                stage = channel[3] if len(channel) == 4 else active_stages()[-1]
+                if stage not in active_stages():
+                    print_error('[ERROR] Unknown stage %s, possible stages: %s' % (stage, ', '.join(active_stages())))
+                    print('     This channel will be skipped')
+                elif int(channel[2]) > 0:
+                    targets.append((channel[0], int(channel[2]), stage))
+            elif channel[1] != '0' and channel[2] != '0':
                 max_number = check_simulation_files(channel[0])  # maximum file number of existing simulation files
                 amount.append((channel[0], int(channel[1]), int(channel[2]), max_number))
             else:
@@ -711,43 +1779,138 @@ def process_config(config_file):
         except:
             print_error('[ERROR] Invalid syntax in the following line:\n%s' % line.rstrip())
             print('     This channel will be skipped')
+    if cocktail_amount:
+        amount.extend(process_cocktail(*cocktail_amount))
+    elif cocktail:
+        print_color('[WARNING] Channel weights given without a cocktail line, the weights will be ignored', RED)
     print()
     return amount
 
+def process_cocktail(files, events):
+    if not cocktail:
+        print_error('[ERROR] No channel weights for the cocktail given')
+        print('     The cocktail will be skipped')
+        return []
+    # the tracked particles differ for every channel, hence Geant needs a dedicated macro for the cocktail
+    if not check_file('g4run', 'g4run_%s.mac' % COCKTAIL):
+        print("        Please provide the particles to be tracked by Geant for the cocktail.")
+        print('     The cocktail will be skipped')
+        return []
+    total = sum(weight for _, weight in cocktail)
+    print('  Cocktail of %d channels:' % len(cocktail))
+    for channel, weight in cocktail:
+        print('  {0:<20s} {1:>6.2f}%'.format(format_channel(channel), weight/total*100))
+    max_number = check_simulation_files(COCKTAIL)  # maximum file number of existing simulation files
+    return [(COCKTAIL, files, events, max_number)]
+
+def load_sweep(file):
+    ''' Read the variants of a sweep; every section of the file is a variant,
+        settings with several comma separated values are expanded to one
+        variant for every combination of the values '''
+    parser = configparser.ConfigParser(inline_comment_prefixes=('#',))
+    if not parser.read(file):
+        print_error("[ERROR] The sweep file '%s' could not be read" % file)
+        return False
+    for section in parser.sections():
+        options = parser.items(section)
+        for setting, _ in options:
+            if setting not in SWEEP_SETTINGS:
+                print_error("[ERROR] Unknown setting '%s' for variant '%s'" % (setting, section))
+                return False
+            if not RECONSTRUCT and SWEEP_SETTINGS[setting] in ('acqu', 'goat'):
+                print_error("[ERROR] Setting '%s' of variant '%s' needs RECONSTRUCT to be enabled" % (setting, section))
+                return False
+        values = [[value.strip() for value in values.split(',')] for _, values in options]
+        for combination in itertools.product(*values):
+            settings = {}
+            for (setting, _), value in zip(options, combination):
+                if setting in ('z_vertex_smearing', 'beam_smearing', 'target_length'):
+                    value = float(value)
+                settings[setting] = value
+            if 'g4run' in settings and not check_path(settings['g4run']):
+                return False
+            # add the varying values to the name if a section is expanded to several variants
+            name = '_'.join([section] + [value for value, vals in zip(combination, values) if len(vals) > 1])
+            variants[re.sub(r'[^\w.+-]', '-', name)] = settings
+    if not variants:
+        print_error("[ERROR] No variants found in the sweep file '%s'" % file)
+        return False
+    return True
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Run the complete simulation chain with Pluto, Geant4, AcquRoot and GoAT')
+    parser.add_argument('config', nargs='?', help='channel configuration file, like the example channel_config')
+    parser.add_argument('--list', dest='list_files', action='store_true', help='list the amount of existing files per channel')
+    parser.add_argument('--list-all', '--listall', dest='list_events', action='store_true', help='list the amount of existing files and events per channel')
+    parser.add_argument('--plan', action='store_true', help='show what would be simulated for the channel config and exit')
+    parser.add_argument('--dry-run', action='store_true', help='show the job graph and the needed resources without running anything')
+    parser.add_argument('--export', metavar='FILE', help='export the job graph and the forecast of the dry run as JSON')
+    parser.add_argument('--status', action='store_true', help='show the jobs recorded in the catalog and the status of a running simulation')
+    parser.add_argument('--sweep', metavar='FILE', help='run every variant defined in the sweep file, like the example sweep_config')
+    parser.add_argument('--executor', default=EXECUTOR, help="where the jobs are executed: 'local', 'slurm' or 'queue' (default: %(default)s)")
+    parser.add_argument('--scheduling', choices=SCHEDULERS, default=SCHEDULING, help='order in which the jobs of the channels are started (default: %(default)s)')
+    parser.add_argument('--benchmark', metavar='STAGE', choices=STAGES, help='benchmark the compression settings on existing files of a stage')
+    parser.add_argument('--worker', action='store_true', help='process jobs from the work queue of the queue executor')
+    parser.add_argument('-y', '--yes', action='store_true', help='run unattended, never wait for user input')
+    return parser.parse_args()
 
 def main():
     # check command line arguments for channel configuration file
+    args = parse_arguments()
+    global unattended, read_only, SCHEDULING
+    dry_run_request = args.dry_run or args.export is not None
+    unattended = args.yes or args.plan or dry_run_request or not sys.stdin.isatty()
+    read_only = args.plan or dry_run_request
+    SCHEDULING = args.scheduling
     channel_config = None
-    list_files = False
-    list_events = False
-    if len(sys.argv) == 2:
-        if sys.argv[1].startswith('--list'):
-            if 'all' in sys.argv[1]:
-                list_events = True
-            else:
-                list_files = True
-        else:
-            file = sys.argv[1]
-            if not check_file('.', file):
-                sys.exit(1)
-            channel_config = open(file, 'r')
-    elif len(sys.argv) > 2:
-        print_error('[ERROR] Too many arguments')
-        print('Usage: %s [%s]' % (sys.argv[0], 'config file'))
-        print('Or to list the amount of existing files:')
-        print('   %s --list' % sys.argv[0])
+    list_files = args.list_files
+    list_events = args.list_events
+    if args.worker:
+        slots = CORES or os.cpu_count() or 1
+        print_color('Worker on %s processes up to %d jobs from %s' % (os.uname()[1], slots, queue_path()), BLUE)
+        from executor import work
+        try:
+            work(queue_path(), slots, QUEUE_LEASE, QUEUE_IDLE, log_size=LOG_SIZE*1E6, log_backups=LOG_BACKUPS)
+        except KeyboardInterrupt:
+            print_error('\nWorker stopped, running jobs have been put back into the queue')
+        sys.exit(0)
+    if args.config:
+        if not check_file('.', args.config):
+            sys.exit(1)
+        channel_config = open(args.config, 'r')
+
+    # listing and status requests only read the data directories and the catalog
+    if args.status:
+        set_paths()
+        show_status()
+        sys.exit(0)
+    if list_files or list_events:
+        set_paths()
+    # check if all needed paths and executables exist, terminate otherwise
+    elif not check_paths():
         sys.exit(1)
 
-    # check if all needed paths and executables exist, terminate otherwise
-    if not check_paths():
+    if args.sweep and not load_sweep(args.sweep):
+        sys.exit(1)
+
+    if not check_compression():
+        sys.exit(1)
+
+    if args.benchmark:
+        sys.exit(0 if compression_benchmark(args.benchmark) else 1)
+
+    # make sure there's enough disk space left before anything is planned
+    if not list_files and not list_events and not args.plan and not dry_run_request and not check_free_space():
         sys.exit(1)
 
     # populate lists with existing simulation files
-    global pluto_files, mkin_files, geant_files
-    sim_files = os.listdir(pluto_data)
-    geant_files = os.listdir(geant_data)
+    global pluto_files, mkin_files, geant_files, merged_files
+    sim_files = list_dir(pluto_data)
+    geant_files = list_dir(geant_data)
     mkin_files = [file for file in sim_files if '_mkin' in file]
     pluto_files = list(set(sim_files) - set(mkin_files))
+    if RECONSTRUCT:
+        merged_files = list_dir(merged_data)
 
     if list_files:
         list_file_amount()
@@ -773,22 +1936,48 @@ def main():
     if SMEAR_Z_VERTEX or SMEAR_BEAM_POSITION:
         print()
 
+    if variants:
+        print_color('NOTE: Sweep over %d variants, files which do not differ are shared:' % len(variants), BLUE)
+        for variant, settings in variants.items():
+            print_color('      %s: %s' % (variant, ', '.join('%s=%s' % item for item in sorted(settings.items())) or 'default settings'), BLUE)
+        print()
+
     amount = []
     if not channel_config:
+        if unattended:
+            print_error('[ERROR] A channel config file is needed for unattended runs')
+            sys.exit(1)
         amount = simulation_dialogue()
     else:
         amount = process_config(channel_config)
         channel_config.close()
 
-    print(str(len(amount)) + " channels configured. The following simulation will take place:")
-    total_files, total_events = 0, 0
+    files = planned_files(amount)
+    plans = []
+    catalog = load_catalog()
+    for channel, target, stage in targets:
+        target_files, plan = plan_target(channel, target, stage, catalog)
+        files.extend(target_files)
+        if plan:
+            plans.append(plan)
+
+    print(str(len(amount) + len(plans)) + " channels configured. The following simulation will take place:")
     for channel, nf, ne, _ in amount:
         print("{0:<20s} {1:>3d} files per {2:>4s} events (total {3:>4s} events)"
                 .format(format_channel(channel), nf, unit_prefix(ne), unit_prefix(nf*ne)))
-        total_files += nf
-        total_events += nf*ne
+    for channel, stage, target, existing, holes, nf, ne in plans:
+        print("{0:<20s} {1:>4s} of {2:>4s} events ({3}), {4:d} missing files, {5:>3d} new files per {6:>4s} events"
+                .format(format_channel(channel), unit_prefix(existing), unit_prefix(target), stage, holes, nf, unit_prefix(ne)))
+    total_files = len(files)
+    total_events = sum(events for _, _, events, _ in files)
     print(" Total %s events in %d files" % (unit_prefix(total_events), total_files))
     print(" Files will be stored in " + DATA_OUTPUT_PATH)
+    print(" %.1f GB free disk space available" % (free_space()/1E9))
+    print(" Random seeds are derived from the master seed %d" % MASTER_SEED)
+    if DISK_BUDGET:
+        print(" Disk usage of this run is limited to %.1f GB" % DISK_BUDGET)
+    if CLEANUP_INTERMEDIATES:
+        print(" Intermediate files will be %s" % ('compressed' if CLEANUP_INTERMEDIATES == 'compress' else 'deleted'))
 
     # simulation including reconstruction (new geant build) for 6M events done in around 72.9 hours --> ca. 12.15 hours per 1M events
     # pure reconstruction time for 1M events ca. 0.16 hours --> pure simulation time 11.99 hours
@@ -811,7 +2000,18 @@ def main():
     if hours > 12:
         print(' Finished approximately:  ' + (datetime.datetime.now() + datetime.timedelta(hours=hours)).strftime(time_format))
 
-    input("\nStart the whole simulation process by hitting enter. ")
+    if args.plan:
+        sys.exit(0)
+
+    if dry_run_request:
+        dry_run(files, args.executor, args.export)
+        sys.exit(0)
+
+    executor = create_executor(args.executor)
+    if not executor:
+        sys.exit(1)
+
+    confirm("\nStart the whole simulation process by hitting enter. ")
 
     # file which is used to save what is currently done
     global current_file
@@ -828,13 +2028,7 @@ def main():
         log.write(' Files will be stored in %s\n' % DATA_OUTPUT_PATH)
         log.flush()
         # do all the simulations
-        pluto_simulation(amount, log)
-        mkin_conversion(amount, log)
-        geant_simulation(amount, log)
-        if RECONSTRUCT:
-            acqu(amount, log)
-            goat(amount, log)
-            hadd(amount, log)
+        simulation_chain(files, log, executor)
         end_date = datetime.datetime.now()
         delta = end_date - start_date
         log.write('--- Finished after %.2f seconds ---' % delta.total_seconds())
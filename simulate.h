@@ -1,6 +1,8 @@
 #ifndef _simulate_h_
 #define _simulate_h_
 
+#include <string>
+
 inline double sgn(double x)
 {
 	if (x < 0) return -1;
@@ -21,7 +23,13 @@ inline double thetaCrit2()
 	return thCr*thCr;
 }
 
-void simulate(Int_t events, Int_t output, const char* channel, const char* output_path);
+void simulate(Int_t events, Int_t output, const char* channel, const char* output_path, UInt_t seed = 0, UInt_t seed_random = 0, Int_t compression = -1);
+void simulate_cocktail(Int_t events, Int_t output, const char* channels, const char* weights, const char* output_path, UInt_t seed = 0, UInt_t seed_random = 0, Int_t compression = -1);
+void init_simulation(UInt_t seed, UInt_t seed_random);
+std::string output_name(const char* output_path, const char* channel, Int_t run);
+std::string temp_name(const char* channel, Int_t run);
+void copy_events(std::string input, std::string output, Int_t compression);
+Bool_t sim_channel(const char* channel, Int_t events, std::string out);
 
 void sim_etap_eeg(Int_t events, char* output);
 void sim_etap_eeg_oldFF(Int_t events, char* output);